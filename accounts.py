@@ -0,0 +1,73 @@
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from config import get_config, get_accounts, new_client
+from portfolio import Portfolio
+from prefetch import prefetch_prices
+from tracing import TRACER
+from profiling import profiled
+
+
+@profiled("run_accounts")
+def run_accounts(base_currency_ticker, accounts=None, client_factory=None, workers=None):
+    """Replay the ledgers of several accounts, returning their portfolios by account.
+
+    `accounts` defaults to the [Account <name>] sections of the config and
+    `client_factory(account)` to a client with the credentials of the
+    section. Each account has its own ledger and portfolio cache under
+    ./data/accounts/<name>/. Prices are shared: the price requests of every
+    account are merged into a single prefetch before the replays, so a rate
+    needed by many accounts is only fetched once.
+    """
+    if accounts is None:
+        accounts = get_accounts()
+    if client_factory is None:
+        client_factory = new_client
+    if workers is None:
+        workers = int(get_config()["Global"].get("account_workers", 4))
+
+    def load(account):
+        return Portfolio.load_from_ledger(base_currency_ticker, client=client_factory(account),
+                                          account=account)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded = dict(zip(accounts, executor.map(load, accounts)))
+
+    pending = [trades_history for _, trades_history in loaded.values()
+               if not trades_history.empty]
+    if pending:
+        prefetch_prices(pd.concat(pending), base_currency_ticker)
+
+    def replay(account):
+        portfolio, trades_history = loaded[account]
+        if not trades_history.empty:
+            logging.debug(f"Replaying {len(trades_history)} ledger entries of {account}")
+            portfolio.update_from_ledger(trades_history, account=account, prefetch=False)
+        return portfolio
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(accounts, executor.map(replay, accounts)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Displays the profits of several Kraken accounts")
+    parser.add_argument("--currency", type=str, default="CHF")
+    parser.add_argument("--accounts", type=str, nargs="+", default=None,
+                        help="names of the [Account <name>] sections to run, all by default")
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = get_config()
+    logging.basicConfig(filename='run_log.log', level=config["Global"].get("log_level", "INFO"),
+                        filemode='w')
+    TRACER.configure_from(config)
+    currency = config["Portfolio"].get("currency", args.currency)
+    portfolios = run_accounts(currency, accounts=args.accounts, workers=args.workers)
+    for account, portfolio in portfolios.items():
+        print(f"{account}:")
+        portfolio.display(tabulation="\t")
@@ -0,0 +1,117 @@
+import logging
+import numpy as np
+import pandas as pd
+from profiling import PROFILER
+from price_store import to_days
+
+# Kraken only serves the most recent 720 candles of an interval
+OHLC_WINDOW = 720
+# Trades before the end of a day looked up to find its close
+TRADES_LOOKBACK = pd.Timedelta(hours=1)
+
+
+def get_window_start():
+    """First day served by the OHLC endpoint, older closes come from trades"""
+    return pd.Timestamp.now().normalize() - pd.Timedelta(days=OHLC_WINDOW - 1)
+
+
+def fetch_ohlc_closes(client, pair, since=None):
+    """Daily closes of `pair` from the OHLC endpoint, after `since` when given"""
+    with PROFILER.timer("network.kraken.ohlc"):
+        ohlc = client.get_ohlc_data(pair, interval=1440, since=since)[0]
+    close = ohlc["close"].astype(float)
+    close.index = pd.DatetimeIndex(close.index).normalize()
+    close = close[~close.index.duplicated(keep="last")]
+    return close.sort_index()
+
+
+def to_timestamp(since):
+    # Trades cursors are in nanoseconds, the first `since` of a walk in seconds
+    return pd.to_datetime(int(since), unit="ns" if int(since) > 10**12 else "s")
+
+
+def fetch_trade_closes(client, pair, days):
+    """Closes of `pair` on each of `days` from one forward walk of its trades.
+
+    The close of a day is its last trade, or the first trade of the next day
+    when nothing was traded on the day. None if nothing was traded until the
+    end of the next day either. The walk follows the `last` cursor of each
+    page and only jumps ahead, to TRADES_LOOKBACK before the end of the next
+    day wanted, when that day starts after the page.
+    """
+    days = sorted(pd.DatetimeIndex(days).normalize().unique())
+    closes = {}
+    one_day = pd.Timedelta(days=1)
+    # Last trade of the previous page, None after a jump
+    previous = None
+    cursor = None
+    i = 0
+    while i < len(days):
+        start = days[i] + one_day - TRADES_LOOKBACK
+        if (cursor is None) or (to_timestamp(cursor) < start):
+            cursor, previous = int(start.timestamp()), None
+        with PROFILER.timer("network.kraken.trades"):
+            trades, last = client.get_recent_trades(pair, since=cursor, ascending=True)
+        if trades.empty:
+            break
+        trades = trades.sort_index()
+        times = pd.DatetimeIndex(trades.index)
+        prices = trades["price"].astype(float).values
+        # Days ending within the page are complete
+        while (i < len(days)) and (days[i] + one_day <= times[-1]):
+            day_start, day_end = days[i], days[i] + one_day
+            before = np.searchsorted(times, day_end, side="left")
+            if before and (times[before - 1] >= day_start):
+                closes[days[i]] = prices[before - 1]
+            elif (before == 0) and (previous is not None) and (previous[0] >= day_start):
+                closes[days[i]] = previous[1]
+            elif times[before] < day_end + one_day:
+                closes[days[i]] = prices[before]
+            else:
+                closes[days[i]] = None
+            i += 1
+        previous = (times[-1], prices[-1])
+        if to_timestamp(last) <= to_timestamp(cursor):
+            break
+        cursor = last
+    for day in days[i:]:
+        # The trades stream ended before the end of these days
+        on_day = (previous is not None) and (day <= previous[0] < day + one_day)
+        closes[day] = previous[1] if on_day else None
+    return closes
+
+
+def backfill_closes(store, client, pair, base, quote, dates):
+    """Daily closes of the Kraken `pair` (`base`/`quote`) covering `dates`.
+
+    Closes are persisted in `store` under (base, quote). Only the tail
+    after the last stored close is requested from the OHLC endpoint, the
+    last stored close being refreshed as it may come from an unfinished
+    candle. Dates older than the OHLC window are backfilled from one walk of
+    the trades endpoint, days without any trade are marked missing in
+    `store` so that they are not queried again.
+    """
+    dates = pd.DatetimeIndex(dates).normalize()
+    today = pd.Timestamp.now().normalize()
+    stored = store.read(base, quote)
+    if stored.empty or (stored.index[-1] < today):
+        since = None if stored.empty else int(
+            (stored.index[-1] - pd.Timedelta(days=1)).timestamp())
+        close = fetch_ohlc_closes(client, pair, since=since)
+        store.append(base, quote, close)
+        stored = store.read(base, quote)
+
+    window_start = get_window_start()
+    known_days = np.union1d(to_days(stored.index), store.read_missing(base, quote))
+    old_dates = dates[(dates < window_start) &
+                      ~pd.Index(to_days(dates)).isin(known_days)].unique()
+    if len(old_dates):
+        logging.info(
+            f"Backfilling {len(old_dates)} closes of {pair} from trades")
+        closes = fetch_trade_closes(client, pair, old_dates)
+        found = {day: close for day, close in closes.items() if close is not None}
+        store.mark_missing(base, quote, [day for day, close in closes.items() if close is None])
+        if found:
+            store.append(base, quote, pd.Series(found, name="close"))
+            stored = store.read(base, quote)
+    return stored
@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+BENCHMARK_CRYPTOS = ["XXBT", "XETH", "ADA", "DOT", "SOL", "XXRP", "XLTC", "LINK",
+                     "ATOM", "XXDG", "MATIC", "ALGO", "XTZ", "FIL", "UNI", "AAVE"]
+BENCHMARK_FIATS = ["USD", "EUR", "CHF", "GBP"]
+# Static files read from ./data by the package
+DATA_FILES = ["Common-Currency.json", "crypto_ticker_converter.json"]
+# Globals of the config module replaced by the offline fakes
+GLOBALS = ["_config", "_client", "_client_factory", "_rates_session"]
+
+
+class MarketModel():
+    """Deterministic daily USD prices of every benchmark asset"""
+
+    def __init__(self, cryptos, days=1100, seed=0):
+        rng = np.random.default_rng(seed)
+        self.dates = pd.date_range(
+            end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+        self.prices = {}
+        for asset in cryptos:
+            walk = np.cumsum(rng.normal(0, 0.04, days))
+            self.prices[asset] = rng.uniform(0.1, 30000) * np.exp(walk)
+        for fiat in BENCHMARK_FIATS:
+            start = 1.0 if fiat == "USD" else rng.uniform(0.9, 1.4)
+            self.prices[fiat] = start * np.exp(np.cumsum(rng.normal(0, 0.003, days)))
+            if fiat == "USD":
+                self.prices[fiat][:] = 1.0
+
+    def get_rate(self, from_currency, to_currency, day=-1):
+        return self.prices[from_currency][day] / self.prices[to_currency][day]
+
+    def get_day(self, date):
+        day = self.dates.searchsorted(pd.Timestamp(date).normalize())
+        return min(day, len(self.dates) - 1)
+
+
+def kraken_name(asset):
+    return f"Z{asset}" if asset in BENCHMARK_FIATS else asset
+
+
+def synthetic_ledger(n_transactions=1000, cryptos=None, base_currency="EUR", days=700, seed=0,
+                     market=None):
+    """Kraken-like ledger of deposits, buys, sells and crypto to crypto trades.
+
+    Balances are tracked so that no trade sells more than is held, and both
+    legs of a trade share their refid and timestamp as in real ledgers.
+    """
+    rng = np.random.default_rng(seed)
+    cryptos = BENCHMARK_CRYPTOS[:8] if cryptos is None else cryptos
+    market = MarketModel(cryptos, seed=seed) if market is None else market
+    start = pd.Timestamp.now().normalize() - pd.Timedelta(days=days)
+    offsets = np.sort(rng.uniform(0, days * 86400, n_transactions))
+    balances = {base_currency: 0.0}
+    rows = []
+
+    def add_row(refid, dtime, kind, asset, amount, fee):
+        balances[asset] = balances.get(asset, 0) + amount - fee
+        rows.append({"dtime": dtime, "refid": refid, "type": kind, "subtype": "",
+                     "aclass": "currency", "asset": asset, "amount": amount, "fee": fee,
+                     "balance": balances[asset]})
+
+    for i, offset in enumerate(offsets):
+        dtime = start + pd.Timedelta(seconds=float(offset))
+        day = market.get_day(dtime)
+        held = [asset for asset in cryptos if balances.get(asset, 0) > 1e-9]
+        choice = rng.random()
+        if (i == 0) or (choice < 0.1) or (balances[base_currency] < 100):
+            add_row(f"D{i:08d}", dtime, "deposit", base_currency,
+                    float(rng.uniform(500, 5000)), 0.0)
+        elif held and (choice < 0.3):
+            # Sell part of a crypto for the base currency
+            asset = held[rng.integers(len(held))]
+            sold = balances[asset] * rng.uniform(0.1, 0.5)
+            bought = sold * market.get_rate(asset, base_currency, day)
+            add_row(f"T{i:08d}", dtime, "trade", asset, -sold, 0.0)
+            add_row(f"T{i:08d}", dtime, "trade", base_currency, bought, bought * 0.0026)
+        elif held and (choice < 0.45):
+            # Crypto to crypto trade
+            asset = held[rng.integers(len(held))]
+            other = cryptos[rng.integers(len(cryptos))]
+            if other == asset:
+                continue
+            sold = balances[asset] * rng.uniform(0.1, 0.5)
+            bought = sold * market.get_rate(asset, other, day)
+            add_row(f"T{i:08d}", dtime, "trade", asset, -sold, 0.0)
+            add_row(f"T{i:08d}", dtime, "trade", other, bought, bought * 0.0026)
+        else:
+            # Buy a crypto with the base currency
+            asset = cryptos[rng.integers(len(cryptos))]
+            spent = balances[base_currency] * rng.uniform(0.05, 0.3)
+            fee = spent * 0.0026
+            bought = (spent - fee) * market.get_rate(base_currency, asset, day)
+            add_row(f"T{i:08d}", dtime, "trade", base_currency, -(spent - fee), fee)
+            add_row(f"T{i:08d}", dtime, "trade", asset, bought, 0.0)
+
+    ledger = pd.DataFrame(rows).set_index("dtime")
+    ledger["ledger_id"] = [f"L{i:08d}" for i in range(len(ledger))]
+    return ledger
+
+
+class FakeKrakenClient():
+    """Offline stand-in for KrakenAPI answering from a MarketModel.
+
+    Cryptos are quoted in USD and EUR, every third one only in USD so that
+    proxy routes are exercised. `latency` seconds are slept on each call.
+    """
+
+    def __init__(self, market, ledger=None, latency=0.0, page_size=50):
+        self.market = market
+        self.ledger = ledger
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = {}
+        self.pairs = {}
+        cryptos = [asset for asset in market.prices if asset not in BENCHMARK_FIATS]
+        for i, asset in enumerate(cryptos):
+            for quote in ["USD"] if i % 3 == 2 else ["USD", "EUR"]:
+                self.pairs[f"{kraken_name(asset)}{kraken_name(quote)}"] = (asset, quote)
+        for fiat in BENCHMARK_FIATS:
+            if fiat != "USD":
+                self.pairs[f"{kraken_name(fiat)}ZUSD"] = (fiat, "USD")
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_pair(self, pair):
+        for name, (base, quote) in self.pairs.items():
+            if pair in (name, f"{base}{quote}"):
+                return name, base, quote
+        raise ValueError(f"Unknown asset pair {pair}")
+
+    def get_tradable_asset_pairs(self):
+        self._call("get_tradable_asset_pairs")
+        names = list(self.pairs)
+        return pd.DataFrame({"altname": [base + quote for base, quote in self.pairs.values()],
+                             "base": [kraken_name(base) for base, _ in self.pairs.values()],
+                             "quote": [kraken_name(quote) for _, quote in self.pairs.values()]},
+                            index=names)
+
+    def get_ticker_information(self, pair):
+        self._call("get_ticker_information")
+        rows = {}
+        for requested in pair.split(","):
+            name, base, quote = self._get_pair(requested)
+            rows[name] = [str(self.market.get_rate(base, quote)), "1"]
+        return pd.DataFrame({"c": list(rows.values())}, index=list(rows))
+
+    def get_ohlc_data(self, pair, interval=1440, since=None, ascending=False):
+        self._call("get_ohlc_data")
+        _, base, quote = self._get_pair(pair)
+        close = self.market.prices[base] / self.market.prices[quote]
+        ohlc = pd.DataFrame({"open": close, "high": close, "low": close, "close": close,
+                             "volume": 1.0}, index=self.market.dates.rename("dtime"))
+        # Only the most recent 720 candles are served, whatever `since`
+        ohlc = ohlc.iloc[-720:]
+        if since is not None:
+            ohlc = ohlc[ohlc.index >= pd.to_datetime(since, unit="s")]
+        ohlc = ohlc.sort_index(ascending=ascending)
+        return ohlc, int(self.market.dates[-1].timestamp())
+
+    def get_recent_trades(self, pair, since=None, ascending=False):
+        self._call("get_recent_trades")
+        _, base, quote = self._get_pair(pair)
+        # Like Kraken, `since` is in seconds or in nanoseconds (the `last` cursor)
+        start = pd.to_datetime(since, unit="ns" if since > 10**12 else "s")
+        # A trade every ten minutes, at the close of its day, 1000 trades per page
+        times = start + pd.to_timedelta(np.arange(1000) * 10, unit="min")
+        times = times[times <= self.market.dates[-1] + pd.Timedelta(days=1)]
+        days = np.minimum(self.market.dates.searchsorted(times.normalize()), len(self.market.dates) - 1)
+        prices = self.market.prices[base][days] / self.market.prices[quote][days]
+        trades = pd.DataFrame({"price": prices, "volume": 1.0, "time": times.astype("int64") // 10**9,
+                               "buy_sell": "b", "market_limit": "m", "misc": ""},
+                              index=times.rename("dtime"))
+        return trades.sort_index(ascending=ascending), int(times[-1].value) if len(times) else since
+
+    def get_ledgers_info(self, ascending=False, start=None, ofs=None, **kwargs):
+        self._call("get_ledgers_info")
+        ledger = self.ledger
+        if start is not None:
+            ledger = ledger.iloc[np.flatnonzero(ledger.ledger_id.values == start)[0] + 1:]
+        # Kraken pages the ledger newest first
+        offset = ofs or 0
+        page = ledger.iloc[::-1].iloc[offset:offset + self.page_size]
+        return page.sort_index(ascending=ascending, kind="stable"), len(ledger)
+
+
+class FakeRatesSession():
+    """Offline stand-in for the ratesapi endpoint, see config.get_rates_session"""
+
+    class Response():
+        def __init__(self, content):
+            self.content = content
+
+        def json(self):
+            return self.content
+
+    def __init__(self, market, latency=0.0):
+        self.market = market
+        self.latency = latency
+        self.calls = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        endpoint = url.rstrip("/").split("/")[-1]
+        base = params["base"]
+        symbols = params.get("symbols")
+        fiats = BENCHMARK_FIATS if symbols is None else symbols.split(",")
+        if endpoint == "history":
+            # Like the ECB reference rates, nothing is published on weekends
+            days = pd.date_range(params["start_at"], params["end_at"])
+            days = days[(days.dayofweek < 5) & (days >= self.market.dates[0]) &
+                        (days <= self.market.dates[-1])]
+            return self.Response({"base": base, "rates": {
+                day.strftime("%Y-%m-%d"): {fiat: self.market.get_rate(base, fiat, self.market.get_day(day))
+                                           for fiat in fiats} for day in days}})
+        day = -1 if endpoint == "latest" else self.market.get_day(endpoint)
+        return self.Response({"base": base, "rates": {
+            fiat: self.market.get_rate(base, fiat, day) for fiat in fiats}})
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark():
+    """Times the main code paths in a scratch directory against the offline fakes"""
+
+    def __init__(self, n_transactions=1000, n_assets=8, base_currency="EUR", latency=0.0, seed=0,
+                 days=700):
+        self.base_currency = base_currency
+        self.latency = latency
+        self.market = MarketModel(BENCHMARK_CRYPTOS[:n_assets], days=max(1100, days + 30), seed=seed)
+        self.ledger = synthetic_ledger(n_transactions, cryptos=BENCHMARK_CRYPTOS[:n_assets],
+                                       base_currency=base_currency, days=days, seed=seed,
+                                       market=self.market)
+        self.params = {"transactions": n_transactions, "ledger_entries": len(self.ledger),
+                       "assets": n_assets, "base_currency": base_currency, "latency": latency,
+                       "seed": seed, "days": days}
+        self.package_dir = os.path.dirname(os.path.abspath(__file__))
+        self.previous_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix="kraken_benchmark_")
+        os.makedirs(os.path.join(self.work_dir, "data"))
+        for file_name in DATA_FILES:
+            shutil.copy(os.path.join(self.package_dir, "data", file_name),
+                        os.path.join(self.work_dir, "data", file_name))
+        shutil.copy(os.path.join(self.package_dir, "config_template.ini"),
+                    os.path.join(self.work_dir, "config.ini"))
+        os.chdir(self.work_dir)
+
+        import config
+        import routes
+        self.client = FakeKrakenClient(self.market, self.ledger, latency=latency)
+        self.rates_session = FakeRatesSession(self.market, latency=latency)
+        # Restored by close()
+        self.previous_globals = {name: getattr(config, name) for name in GLOBALS}
+        self.previous_route_planner = routes._route_planner
+        routes._route_planner = None
+        config._config = None
+        config._client = self.client
+        config._client_factory = lambda: self.client
+        config._rates_session = self.rates_session
+        # The fakes have no call counter, prefetch workers are not throttled
+        config.get_config()["API"]["tier"] = "None"
+
+    def reset(self, keep_prices):
+        """Forget the portfolio and ledger, and the prices unless `keep_prices`"""
+        import routes
+        from currencies import PRICE_CACHE
+        data_dir = os.path.join(self.work_dir, "data")
+        for file_name in os.listdir(data_dir):
+            path = os.path.join(data_dir, file_name)
+            if file_name in DATA_FILES or (keep_prices and file_name == "prices"):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        routes._route_planner = None
+        if not keep_prices:
+            PRICE_CACHE.clear()
+
+    def count_calls(self):
+        return sum(self.client.calls.values()) + self.rates_session.calls
+
+    def time_scenario(self, name, setup, run, repeat):
+        timings, calls = [], []
+        for _ in range(repeat):
+            setup()
+            calls_before = self.count_calls()
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+            calls.append(self.count_calls() - calls_before)
+        print(f"{name}: {min(timings):.4f}s (best of {repeat}), {calls[-1]} remote calls")
+        return {"seconds": min(timings), "timings": timings, "remote_calls": calls[-1]}
+
+    def run(self, repeat=3):
+        from portfolio import Portfolio
+        from currencies import CurrencyUnit, PRICE_CACHE
+        base = self.base_currency
+        state = {}
+
+        def replay():
+            state["portfolio"] = Portfolio.from_kraken_ledger(base)
+
+        def display():
+            state["portfolio"].display(verbose=False,
+                                       currency_unit=CurrencyUnit.create_currency_unit(base))
+
+        def forget_display():
+            state["portfolio"].invalidate()
+            for security in state["portfolio"].securities.values():
+                security.invalidate()
+
+        def cold_display():
+            forget_display()
+            PRICE_CACHE.clear()
+            latest = os.path.join(self.work_dir, "data", "prices", "latest.json")
+            if os.path.exists(latest):
+                os.remove(latest)
+
+        def old_values():
+            state["portfolio"].get_old_values(per_currency=True,
+                                              start_date=str(self.ledger.index[0].date()))
+
+        results = {
+            "replay_cold": self.time_scenario("replay_cold", lambda: self.reset(False), replay, repeat),
+            "replay_warm": self.time_scenario("replay_warm", lambda: self.reset(True), replay, repeat),
+            "display_cold": self.time_scenario("display_cold", cold_display, display, repeat),
+            "display_warm": self.time_scenario("display_warm", forget_display, display, repeat),
+            "get_old_values": self.time_scenario("get_old_values", lambda: None, old_values, repeat),
+        }
+        return {"revision": git_revision(), "time": time.time(), "python": platform.python_version(),
+                "params": self.params, "results": results}
+
+    def close(self):
+        """Leave the scratch directory, restoring the configuration and clients replaced"""
+        import config
+        import routes
+        from currencies import PRICE_CACHE
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        for name, value in self.previous_globals.items():
+            setattr(config, name, value)
+        routes._route_planner = self.previous_route_planner
+        # Prices of the synthetic market must not outlive it
+        PRICE_CACHE.clear()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Times ledger replay, display and history on a synthetic account, offline")
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--assets", type=int, default=8)
+    parser.add_argument("--currency", type=str, default="EUR")
+    parser.add_argument("--days", type=int, default=700,
+                        help="span of the ledger, beyond 720 days old closes are backfilled from trades")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds slept by the fake Kraken and ratesapi on each call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="benchmark_results.json",
+                        help="JSON file the results are appended to")
+    return parser.parse_args()
+
+
+def main(args):
+    output = os.path.abspath(args.output)
+    benchmark = Benchmark(args.transactions, min(args.assets, len(BENCHMARK_CRYPTOS)),
+                          base_currency=args.currency, latency=args.latency, seed=args.seed,
+                          days=args.days)
+    try:
+        result = benchmark.run(repeat=args.repeat)
+    finally:
+        benchmark.close()
+    history = []
+    if os.path.exists(output):
+        with open(output, "r") as f:
+            history = json.load(f)
+    history.append(result)
+    with open(output, "w") as f:
+        json.dump(history, f, indent=2)
+    print(f"Results appended to {output}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
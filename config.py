@@ -1,20 +1,66 @@
-import krakenex
-from pykrakenapi import KrakenAPI
 import configparser
 
+CONFIG_PATH = './config.ini'
+# Sections holding the credentials of each account of the multi-account runner
+ACCOUNT_SECTION_PREFIX = "Account "
+_config = None
+_client = None
+# Overrides of the Kraken client constructor and of the ratesapi HTTP session
+_client_factory = None
+_rates_session = None
 
-def create_client_from_config(config):
-    retry = config["API"].get("retry", 0)
-    crl_sleep = config["API"].get("crl_sleep", 5)
-    tier = config["API"].get("tier", "Intermediate")
-    api_key = config["API"].get("key", None)
-    secret = config["API"].get("secret", None)
+
+def create_client_from_config(config, account=None):
+    """KrakenAPI client of [API], with the key and settings of [Account <account>] if given"""
+    import krakenex
+    from pykrakenapi import KrakenAPI
+
+    api_config = dict(config["API"])
+    if account is not None:
+        api_config.update(config[ACCOUNT_SECTION_PREFIX + account])
+    retry = api_config.get("retry", 0)
+    crl_sleep = api_config.get("crl_sleep", 5)
+    tier = api_config.get("tier", "Intermediate")
+    api_key = api_config.get("key", None)
+    secret = api_config.get("secret", None)
     client = krakenex.API(key=api_key, secret=secret)
     client = KrakenAPI(client, retry=float(retry), crl_sleep=float(crl_sleep), tier=tier)
     return client
 
 
-# Read local file `config.ini`.
-config = configparser.ConfigParser()
-config.read('./config.ini')
-client = create_client_from_config(config)
+def get_config():
+    # Read local file `config.ini` on first use
+    global _config
+    if _config is None:
+        _config = configparser.ConfigParser()
+        _config.read(CONFIG_PATH)
+    return _config
+
+
+def get_accounts(config=None):
+    """Names of the accounts configured in [Account <name>] sections"""
+    config = get_config() if config is None else config
+    return [section[len(ACCOUNT_SECTION_PREFIX):] for section in config.sections()
+            if section.startswith(ACCOUNT_SECTION_PREFIX)]
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = create_client_from_config(get_config())
+    return _client
+
+
+def new_client(account=None):
+    """A client of its own, for threads that must not share call counters"""
+    if _client_factory is not None:
+        return _client_factory()
+    return create_client_from_config(get_config(), account=account)
+
+
+def get_rates_session():
+    """Object whose `get(url, params)` queries ratesapi, `requests` by default"""
+    if _rates_session is None:
+        import requests
+        return requests
+    return _rates_session
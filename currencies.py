@@ -1,99 +1,249 @@
-import requests
-from forex_python.converter import CurrencyRates
-from utils import URL_MARKET_PRICE, URL_MARKET_PRICE_FIAT, KRAKEN_PUBLIC_END_POINT, FIAT_CURRENCIES
-from utils import CRYPTO_ALT_NAMES
-from utils import url_join, save_data, get_pair_from_kraken, ts_format, read_data
-from utils import get_cached as utils_get_cached
+from utils import URL_MARKET_PRICE, URL_MARKET_PRICE_FIAT, KRAKEN_PUBLIC_END_POINT, get_fiat_currencies
+from utils import url_join, ts_format, get_latest_pairs_from_kraken
+from routes import get_route_planner, normalize_asset, KRAKEN
+from backfill import backfill_closes, get_window_start
 import json
-import logging
-from config import client, config
+from config import get_client, get_config, get_rates_session
 import pandas as pd
-from numbers import Number
+import numpy as np
+from price_cache import PriceCache
+from price_store import PriceStore, NEAREST
+import time
+import inspect
+from functools import wraps
+from tracing import TRACER
+from profiling import profiled
+
+PRICE_CACHE = PriceCache()
+PRICE_STORE = PriceStore()
+FIAT_LOOKBACK_DAYS = 7
+
+
+def get_max_staleness():
+    """Days a close may be away from the date it prices"""
+    return int(get_config()["Global"].get("max_price_staleness", 7))
+
+
+@profiled("network.ratesapi")
+def query_fiat_rates(date_query, base):
+    """ratesapi exchange rates of `base` on `date_query` (a date or "latest")"""
+    price_url = url_join(URL_MARKET_PRICE_FIAT, date_query)
+    return get_rates_session().get(price_url, params={"base": base}).json()["rates"]
+
+
+@profiled("network.ratesapi")
+def query_fiat_history(base, to, start, end):
+    """ratesapi daily rates of `base` in `to` from `start` to `end`, one request"""
+    price_url = url_join(URL_MARKET_PRICE_FIAT, "history")
+    rates = get_rates_session().get(price_url, params={
+        "base": base, "symbols": to, "start_at": start.strftime("%Y-%m-%d"),
+        "end_at": end.strftime("%Y-%m-%d")}).json()["rates"]
+    rates = pd.Series({pd.Timestamp(day): float(day_rates[to]) for day, day_rates in rates.items()},
+                      dtype=np.float64)
+    return rates.sort_index()
 
 
 class CurrencyUnit():
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
+    def __setstate__(self, state):
+        # Units pickled before __slots__ carry a plain attribute dict
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def convert(self, to, amount, date=None):
         raise NotImplementedError
 
+    def is_same_asset(self, to):
+        # Kraken prefixed names (ZEUR, XXBT) are the same asset as EUR, XBT
+        return (to == self.name) or (normalize_asset(to) == normalize_asset(self.name))
+
     def create_currency(self, base_currency_unit=None):
         raise NotImplementedError
 
-    def get_cached(self, to, date, attr="price"):
-        expiration = float(config["Global"].get("ttl", 3600))
-        price_data, requested_price = None, None
+    def get_cached(self, to, date):
+        expiration = float(get_config()["Global"].get("ttl", 3600))
+        requested_price = None
         if (date == None) or (date.normalize() == pd.to_datetime("now").normalize()):
-            save_file = f"{self.name}_{to}_latest.pkl"
-            price_data = utils_get_cached(save_file, expiration=expiration)
-            if price_data is not None:
-                requested_price = price_data["value"]
+            cache_key = (self.name, to, None)
+            requested_price = PRICE_CACHE.get(cache_key)
+            if requested_price is not None:
+                return requested_price, date
+
+            latest = PRICE_STORE.get_latest(
+                self.name, to, expiration=expiration)
+            if latest is not None:
+                requested_price, ts = latest
+                PRICE_CACHE.set(cache_key, requested_price,
+                                ttl=expiration - (time.time() - ts))
         else:
             date = ts_format(date)
             date = date.normalize()
+            requested_price = PRICE_CACHE.get((self.name, to, date))
+            if requested_price is not None:
+                return requested_price, date
 
-            save_file = f"{self.name}_{to}.pkl"
-            requested_price = None
+            # Check if the exchange rate for the requested date is stored
+            requested_price = PRICE_STORE.lookup(self.name, to, date)
+            if requested_price is not None:
+                PRICE_CACHE.set((self.name, to, date), requested_price)
 
-            price_data = read_data(save_file, add_path_prefix=True)
-            # No cached exchange rates
-            if price_data is not None:
-                # Check if the exchange rate for the requested date is available
-                price_data = price_data["value"]
-                if date in price_data.index:
-                    requested_price = price_data.loc[date]
-                    requested_price = float(
-                        requested_price[attr])
+        return requested_price, date
 
-        return price_data, requested_price, date
+    def cache_price(self, to, date, price):
+        if (date == None) or (date.normalize() == pd.to_datetime("now").normalize()):
+            PRICE_STORE.set_latest(self.name, to, price)
+            PRICE_CACHE.set((self.name, to, None), price,
+                            ttl=float(get_config()["Global"].get("ttl", 3600)))
+        else:
+            PRICE_CACHE.set((self.name, to, date), price)
+
+    def get_stored_price(self, to, date):
+        """Stored close nearest to `date`, within the configured staleness limit"""
+        max_staleness = get_max_staleness()
+        price = PRICE_STORE.lookup_many(self.name, to, [date], policy=NEAREST,
+                                        max_staleness=max_staleness)[0]
+        if np.isnan(price):
+            raise ValueError(
+                f"No {self.name}/{to} price within {max_staleness} days of {date}")
+        return float(price)
+
+    def preload_prices(self, to, dates):
+        """Put the closes stored for the days of `dates` in the price cache at once"""
+        to = to if isinstance(to, str) else to.name
+        dates = pd.DatetimeIndex(dates).normalize().unique()
+        dates = dates[dates != pd.to_datetime("now").normalize()]
+        if (to == self.name) or (len(dates) == 0):
+            return
+        prices = PRICE_STORE.lookup_many(self.name, to, dates, max_staleness=0)
+        for date, price in zip(dates, prices):
+            if not np.isnan(price):
+                PRICE_CACHE.set((self.name, to, date), float(price))
+
+    def get_price_series(self, to, dates):
+        to = to if isinstance(to, str) else to.name
+        dates = pd.DatetimeIndex(dates).normalize()
+        if self.is_same_asset(to):
+            return pd.Series(1.0, index=dates)
+
+        today = pd.to_datetime("now").normalize()
+        past_dates = dates[dates != today]
+        prices = pd.Series(np.nan, index=dates)
+        if len(past_dates):
+            if not PRICE_STORE.covers(self.name, to, past_dates):
+                self.fetch_history(to, past_dates)
+            # Dates missing from the series take the closest available close
+            prices[past_dates] = PRICE_STORE.lookup_many(
+                self.name, to, past_dates, policy=NEAREST, max_staleness=get_max_staleness())
+        if len(past_dates) != len(dates):
+            prices[dates == today] = self.convert(to, 1)
+        return prices
+
+    def get_route(self, to, kraken_client):
+        route = get_route_planner(kraken_client).route(self.name, to)
+        if route is None:
+            raise ValueError(f"Cannot convert {self.name} to {to}")
+        return route
+
+    @profiled("fetch_route_latest")
+    def fetch_route_latest(self, to, kraken_client):
+        """Latest `self`/`to` rate, chaining the legs of the planned route"""
+        route = self.get_route(to, kraken_client)
+        prices = get_latest_pairs_from_kraken(
+            kraken_client, {leg.pair for leg in route if leg.source == KRAKEN})
+        price = 1.0
+        for leg in route:
+            if leg.source == KRAKEN:
+                leg_price = prices[leg.pair]
+            else:
+                leg_price = FiatUnit(leg.from_currency).fetch_latest(leg.to_currency)
+            price *= 1 / leg_price if leg.invert else leg_price
+        return price
+
+    @profiled("fetch_route_history")
+    def fetch_route_history(self, to, dates, kraken_client):
+        """Daily `self`/`to` closes, chaining the legs of the planned route"""
+        route = self.get_route(to, kraken_client)
+        if not route:
+            # Both names normalize to the same asset
+            return pd.Series(1.0, index=pd.DatetimeIndex(dates).normalize().unique(), name="close")
+        close = None
+        for leg in route:
+            if leg.source == KRAKEN:
+                base, quote = (leg.to_currency, leg.from_currency) if leg.invert else \
+                    (leg.from_currency, leg.to_currency)
+                leg_close = backfill_closes(
+                    PRICE_STORE, kraken_client, leg.pair, base, quote, dates)
+            else:
+                leg_close = FiatUnit(leg.from_currency).fetch_history(
+                    leg.to_currency, dates)
+            leg_close = leg_close.astype(float)
+            if leg.invert:
+                leg_close = 1 / leg_close
+            close = leg_close if close is None else (close * leg_close).dropna()
+        return close.sort_index().rename("close")
+
+    def store_history(self, to, close, dates):
+        """Store the `self`/`to` closes of a route, marking the old dates it has none for"""
+        PRICE_STORE.append(self.name, to, close)
+        dates = pd.DatetimeIndex(dates).normalize()
+        old_dates = dates[dates < get_window_start()]
+        PRICE_STORE.mark_missing(self.name, to, old_dates[~old_dates.isin(close.dropna().index)])
+
+    def fetch_latest(self, to, kraken_client=None):
+        """Query the latest `self`/`to` rate and store it"""
+        raise NotImplementedError
+
+    def fetch_history(self, to, dates, kraken_client=None):
+        """Query the `self`/`to` closes covering `dates` and store them"""
+        raise NotImplementedError
 
     @classmethod
     def create_currency_unit(clf, name):
-        if name in FIAT_CURRENCIES:
+        if name in get_fiat_currencies():
             return FiatUnit(name)
         else:
             return CryptoUnit(name)
 
 
 class CryptoUnit(CurrencyUnit):
+    __slots__ = ()
 
+    @profiled("convert")
     def convert(self, to, amount, date=None):
-        logging.debug(f"Convert {locals()}")
         to = to if isinstance(to, str) else to.name
 
-        if to == self.name:
+        if self.is_same_asset(to):
             return amount
 
-        price_data, requested_price, date = self.get_cached(
-            to, date, attr="close")
+        requested_price, date = self.get_cached(to, date)
 
         if requested_price is None:
-            requested_price_kraken = get_pair_from_kraken(
-                self.name, to, client, date=date)
             if (date == None) or (date.normalize() == pd.to_datetime("now").normalize()):
-                save_file = f"{self.name}_{to}_latest.pkl"
-                requested_price = float(requested_price_kraken)
-                save_data(requested_price, save_file)
+                requested_price = self.fetch_latest(to)
             else:
-                save_file = f"{self.name}_{to}.pkl"
-                # Get the exchange rate for the closest date to the requested date
-                requested_price = requested_price_kraken.index.get_loc(
-                    date, method='nearest')
-                requested_price = requested_price_kraken["close"].iloc[requested_price]
-                if not isinstance(requested_price, Number):
-                    requested_price = requested_price.iloc[0]
+                self.fetch_history(to, [date])
+                requested_price = self.get_stored_price(to, date)
+                self.cache_price(to, date, requested_price)
 
-                requested_price_kraken = requested_price_kraken[["close"]]
-                logging.debug(
-                    f"Price data queried {price_data}: {type(price_data)}")
-
-                save_data(requested_price_kraken, save_file)
+        return requested_price*amount
 
-        logging.debug(f"Price data {price_data}: {type(price_data)}")
-        logging.debug(f"Price data {requested_price}: {type(requested_price)}")
+    def fetch_latest(self, to, kraken_client=None):
+        kraken_client = get_client() if kraken_client is None else kraken_client
+        price = float(self.fetch_route_latest(to, kraken_client))
+        self.cache_price(to, None, price)
+        return price
 
-        return requested_price*amount
+    def fetch_history(self, to, dates, kraken_client=None):
+        kraken_client = get_client() if kraken_client is None else kraken_client
+        close = self.fetch_route_history(to, dates, kraken_client)
+        self.store_history(to, close, dates)
+        return close
 
     def create_currency(self, base_currency_unit=None):
         if base_currency_unit is None:
@@ -109,44 +259,58 @@ class CryptoUnit(CurrencyUnit):
 
 
 class FiatUnit(CurrencyUnit):
+    __slots__ = ()
 
+    @profiled("convert")
     def convert(self, to, amount, date=None):
-        logging.debug(f"Convert {locals()}")
         to = to if isinstance(to, str) else to.name
 
-        if to == self.name:
+        if self.is_same_asset(to):
             return amount
 
-        price_data, requested_price, date = self.get_cached(to, date)
+        requested_price, date = self.get_cached(to, date)
 
         if requested_price is None:
             if (date == None) or (date.normalize() == pd.to_datetime("now").normalize()):
-                save_file = f"{self.name}_{to}_latest.pkl"
-
-                price_url = url_join(URL_MARKET_PRICE_FIAT, "latest")
-                requested_price = requests.get(price_url, params={
-                    "base": self.name}).json()["rates"][to]
-                requested_price = float(requested_price)
-                save_data(requested_price, save_file, add_path_prefix=True)
+                requested_price = self.fetch_latest(to)
             else:
-                save_file = f"{self.name}_{to.name}.pkl"
-                date_query = date.strftime(
-                    "%Y-%m-%d")
-                price_url = url_join(URL_MARKET_PRICE_FIAT, date_query)
-                requested_price = requests.get(price_url, params={
-                    "base": self.name})["rates"][to]
-                requested_price = float(requested_price)
-                new_value = pd.Series(
-                    name=date, data={"price": requested_price}).to_frame()
-
-                if price_data is None:
-                    price_data = price_data.append(new_value)
-                else:
-                    price_data = new_value
-                save_data(price_data, save_file, add_path_prefix=True)
+                # The whole span up to today is fetched at once, so that the
+                # following dates of a replay are already stored
+                self.fetch_history(
+                    to, pd.date_range(date, pd.to_datetime("now").normalize()))
+                requested_price = self.get_stored_price(to, date)
+                self.cache_price(to, date, requested_price)
 
         return requested_price*amount
 
+    def fetch_latest(self, to, kraken_client=None):
+        if to not in get_fiat_currencies():
+            kraken_client = get_client() if kraken_client is None else kraken_client
+            price = float(self.fetch_route_latest(to, kraken_client))
+            self.cache_price(to, None, price)
+            return price
+        price = float(query_fiat_rates("latest", self.name)[to])
+        self.cache_price(to, None, price)
+        return price
+
+    def fetch_history(self, to, dates, kraken_client=None):
+        if to not in get_fiat_currencies():
+            kraken_client = get_client() if kraken_client is None else kraken_client
+            close = self.fetch_route_history(to, dates, kraken_client)
+            self.store_history(to, close, dates)
+            return close
+        dates = pd.DatetimeIndex(dates).normalize()
+        start, end = dates.min(), dates.max()
+        # Rates are not published on weekends and holidays: a few days before
+        # the span are queried so that its first days can be forward filled
+        rates = query_fiat_history(
+            self.name, to, start - pd.Timedelta(days=FIAT_LOOKBACK_DAYS), end)
+        days = pd.date_range(start, end)
+        prices = rates.reindex(rates.index.union(days)).ffill().bfill().reindex(days)
+        prices = prices.rename("close")
+        PRICE_STORE.append(self.name, to, prices)
+        return prices
+
     def create_currency(self, base_currency_unit=None):
         if base_currency_unit is None:
             base_currency_unit = self
@@ -159,8 +323,110 @@ class FiatUnit(CurrencyUnit):
         return str(self)
 
 
-class Currency():
+@profiled("fetch_latest_prices")
+def fetch_latest_prices(names, to, kraken_client=None, refresh=False):
+    """Fetch the latest rate of every currency in `names` to `to` at once.
+
+    Crypto rates come from one Kraken Ticker request covering the pairs of
+    every planned route made only of Kraken legs, fiat rates from one
+    ratesapi request. Other currencies are left to the lazy convert path,
+    unless `refresh` is set: their cached rates are then fetched again one
+    by one. Rates still cached are only fetched again with `refresh`.
+    """
+    to = to if isinstance(to, str) else to.name
+    kraken_client = get_client() if kraken_client is None else kraken_client
+    fiat_currencies = get_fiat_currencies()
+    missing = [name for name in set(names) if name != to and (
+        refresh or CurrencyUnit.create_currency_unit(name).get_cached(to, None)[0] is None)]
+
+    priced = {}
+    crypto_names = [name for name in missing if name not in fiat_currencies]
+    if crypto_names:
+        planner = get_route_planner(kraken_client)
+        routes = {}
+        for name in crypto_names:
+            route = planner.route(name, to)
+            if route and all(leg.source == KRAKEN for leg in route):
+                routes[name] = route
+        prices = get_latest_pairs_from_kraken(
+            kraken_client, {leg.pair for route in routes.values() for leg in route})
+        for name, route in routes.items():
+            if all(leg.pair in prices for leg in route):
+                priced[name] = float(np.prod(
+                    [1 / prices[leg.pair] if leg.invert else prices[leg.pair] for leg in route]))
+
+    fiat_names = [name for name in missing if name in fiat_currencies]
+    if fiat_names and (to in fiat_currencies):
+        rates = query_fiat_rates("latest", to)
+        for name in fiat_names:
+            if name in rates:
+                priced[name] = 1 / float(rates[name])
+
+    # The whole batch is stored with a single write
+    PRICE_STORE.set_latest_many({(name, to): price for name, price in priced.items()})
+    ttl = float(get_config()["Global"].get("ttl", 3600))
+    for name, price in priced.items():
+        PRICE_CACHE.set((name, to, None), price, ttl=ttl)
+
+    if refresh:
+        for name in set(missing) - set(priced):
+            CurrencyUnit.create_currency_unit(name).fetch_latest(to, kraken_client=kraken_client)
+
+
+def memoized(method):
+    """Memoize an aggregate per (currency_unit, date) until the next invalidate().
+
+    A `currency_unit` of None stands for the base currency unit, so that both
+    spellings share one entry.
+    """
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        key = [method.__name__]
+        for name, value in list(arguments.arguments.items())[1:]:
+            if (name == "currency_unit") and (value is None):
+                value = self.base_currency_unit
+            key.append(value.name if isinstance(value, CurrencyUnit) else value)
+        key = tuple(key)
+        memo = getattr(self, "_memo", None)
+        if memo is None:
+            memo = self._memo = {}
+        if key not in memo:
+            memo[key] = method(self, *args, **kwargs)
+        return memo[key]
+    return wrapper
+
+
+class MemoizedAggregates():
+    """Holder of memoized aggregates, to be invalidated on every state change"""
+    __slots__ = ()
+
+    def invalidate(self):
+        self._memo = None
+
+    def __getstate__(self):
+        # Memoized values depend on live prices and are never persisted
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        state.pop("_memo", None)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Currency(MemoizedAggregates):
     URL_MARKET_PRICE = url_join(KRAKEN_PUBLIC_END_POINT, "Ticker")
+    # A portfolio holds one Currency per asset, fixed slots keep them small
+    __slots__ = ("ticker", "base_currency_unit", "value", "currency_unit", "total_invested",
+                 "total_invested_up_now", "realized_profit", "avg_base_price", "_memo")
 
     def __init__(self, ticker, base_currency_unit):
         self.ticker = ticker
@@ -173,6 +439,11 @@ class Currency():
         self.realized_profit = 0
         self.compute_avg_base_price()
 
+    def state(self):
+        return {"ticker": self.ticker, "value": self.value, "total_invested": self.total_invested,
+                "total_invested_up_now": self.total_invested_up_now,
+                "realized_profit": self.realized_profit, "avg_base_price": self.avg_base_price}
+
     def compute_avg_base_price(self):
         if self.value != 0:
             self.avg_base_price = self.total_invested/self.value
@@ -213,9 +484,6 @@ class Currency():
         return self.realized_profit / denom
 
     def withdraw(self, value, fee=0, update_avg_price=True):
-        logging.debug(f"Withdraw {self.ticker}")
-        logging.debug(f"\t Withdraw Args: {locals()}")
-
         value_with_fee = value + fee
         if value_with_fee > self.value:
             raise ValueError(
@@ -223,51 +491,39 @@ class Currency():
 
         avg_value_with_fees = value_with_fee*self.avg_base_price
 
+        self.invalidate()
         self.value -= value_with_fee
         self.total_invested -= (value_with_fee*self.avg_base_price)
         if update_avg_price:
             self.compute_avg_base_price()
-        logging.debug(f"Withdraw {self.ticker} finished")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"{self.ticker}_Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
+        if TRACER.enabled:
+            TRACER.emit("currency.withdraw", withdraw_value=value,
+                        fee=fee, **self.state())
 
         return (avg_value_with_fees, self.base_currency_unit)
 
     def sell(self, buy_currency, value_sold, value_bought, sell_fee=0,
              buy_fee=0, date=None):
-        logging.debug(f"sell {self.ticker}")
-        logging.debug(f"\t sell Args: {locals()}")
         avg_value_with_fees, _ = self.withdraw(
             value_sold, fee=sell_fee, update_avg_price=False)
-        logging.debug(
-            f"AVG VALUE WITH FEES {self.ticker + buy_currency.ticker}: {avg_value_with_fees}")
         realized_profit = buy_currency.currency_unit.convert(
             self.base_currency_unit, value_bought, date=date)
-        logging.debug(
-            f"Price at SELL {self.ticker + buy_currency.ticker}: {realized_profit}")
         realized_profit = realized_profit - avg_value_with_fees
-        logging.debug(
-            f"REALIZED PROFIT {self.ticker + buy_currency.ticker}: {realized_profit}")
         self.realized_profit += realized_profit
         buy_rate = value_sold/value_bought
         buy_currency.buy(self, value_bought, buy_rate,
                          buy_fee=buy_fee, date=date)
         self.compute_avg_base_price()
-        logging.debug(f"Sell {self.ticker} finished")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"{self.ticker}_Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
+        if TRACER.enabled:
+            TRACER.emit("currency.sell", buy_ticker=buy_currency.ticker, value_sold=value_sold,
+                        value_bought=value_bought, sold_realized_profit=realized_profit,
+                        **self.state())
 
         return realized_profit, self.base_currency_unit
 
     def top_up(self, value, fee=0, avg_base_price=None,
                avg_base_price_currency_unit=None, update_avg_price=True,
                date=None):
-        logging.debug(f"Top up with {self.ticker}")
-        logging.debug(f"\t top up Args: {locals()}")
         if avg_base_price is None:
             avg_base_price = self.get_current_unit_value()
         elif avg_base_price_currency_unit is not None:
@@ -275,36 +531,28 @@ class Currency():
                 self.base_currency_unit, avg_base_price, date=date)
 
         value_with_fees = value - fee
+        self.invalidate()
         self.value += value_with_fees
         top_up_base = (value*avg_base_price)
-        logging.debug(f"{self.ticker} Top up base value  {top_up_base}")
         self.total_invested += top_up_base
         self.total_invested_up_now += top_up_base
         if update_avg_price:
             self.compute_avg_base_price()
 
-        logging.debug(f"{self.ticker} Top up finished {self}")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"{self.ticker}_Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
+        if TRACER.enabled:
+            TRACER.emit("currency.top_up", top_up_value=value, fee=fee,
+                        top_up_base=top_up_base, **self.state())
 
     def buy(self, from_currency, value, buy_rate, buy_fee=0, date=None):
-
-        logging.debug(f"Buy {self.ticker}")
-        logging.debug(f"\t buy Args: {locals()}")
-
         self.top_up(value, fee=buy_fee, avg_base_price=from_currency.avg_base_price*buy_rate,
                     avg_base_price_currency_unit=from_currency.base_currency_unit,
                     update_avg_price=True,
                     date=date)
+        if TRACER.enabled:
+            TRACER.emit("currency.buy", from_ticker=from_currency.ticker,
+                        buy_rate=buy_rate, **self.state())
 
-        logging.debug(f"{self.ticker} Buy finished")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"{self.ticker}_Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
-
+    @memoized
     def get_total_return(self, currency_unit=None, date=None):
         total_return = (self.get_current_value(
             date=date) - self.total_invested)
@@ -313,15 +561,16 @@ class Currency():
                 currency_unit, total_return, date=date)
         return total_return
 
+    @memoized
     def get_return_rate(self, date=None):
         if self.total_invested == 0:
             return 0
         return self.get_total_return(date=date)/self.total_invested
 
+    @memoized
     def get_current_value(self, currency_unit=None, date=None):
         if currency_unit is None:
             currency_unit = self.base_currency_unit
-            logging.debug(f"CU: {currency_unit}")
         return self.currency_unit.convert(currency_unit, self.value, date=date)
 
     def get_current_unit_value(self, currency_unit=None):
@@ -365,6 +614,8 @@ class Currency():
 
 
 class FiatCurrency(Currency):
+    __slots__ = ()
+
     def __init__(self, ticker, base_currency_unit):
         super().__init__(ticker, base_currency_unit)
         self.currency_unit = FiatUnit(ticker)
@@ -377,6 +628,8 @@ class FiatCurrency(Currency):
 
 
 class CryptoCurrency(Currency):
+    __slots__ = ()
+
     def __init__(self, ticker, base_currency_unit):
         super().__init__(ticker, base_currency_unit)
         self.currency_unit = CryptoUnit(ticker)
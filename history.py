@@ -0,0 +1,163 @@
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config import get_config
+from currencies import CurrencyUnit
+from snapshots import SNAPSHOT_FIELDS, PORTFOLIO_KEY
+from profiling import profiled
+
+HISTORY_FUNCS = ["get_current_value", "get_total_return", "get_return_rate"]
+TOTAL_COLUMN = "Total"
+
+
+def safe_divide(numerator, denominator):
+    # Mirrors the `if denom == 0: return 0` convention of the scalar getters
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = numerator / denominator
+    return np.where(denominator == 0, 0, result)
+
+
+def valuation(values, invested, prices):
+    """Current value, total return and return rate from holdings and prices"""
+    current_value = values * prices
+    total_return = current_value - invested
+    return_rate = np.where(np.isnan(invested), np.nan,
+                           safe_divide(total_return, invested))
+    return current_value, total_return, return_rate
+
+
+def held_prices(security, base, dates, values):
+    """Prices of `security` in `base` on the dates it is held (`values` non-zero).
+
+    No price is requested for the other dates: they are NaN before the
+    security is held and 0 once it is sold out, so that its value is 0.
+    """
+    prices = np.where(values == 0, 0.0, np.nan)
+    held = ~np.isnan(values) & (values != 0)
+    if held.any():
+        prices[held] = CurrencyUnit.create_currency_unit(security).get_price_series(
+            base, dates[held]).values
+    return prices
+
+
+def attach_shared_array(name, shape):
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+def security_history(task):
+    """Worker process: valuation of one security, written to the shared output"""
+    states_name, states_shape, output_name, output_shape, key_id, column, security, base, dates = task
+    states_block, states = attach_shared_array(states_name, states_shape)
+    output_block, output = attach_shared_array(output_name, output_shape)
+    try:
+        # Price series are read from the memory-mapped price store
+        values = states[:, key_id, SNAPSHOT_FIELDS.index("value")]
+        output[:, :, column] = valuation(values,
+                                         states[:, key_id, SNAPSHOT_FIELDS.index(
+                                             "total_invested")],
+                                         held_prices(security, base, dates, values))
+    finally:
+        del states, output
+        states_block.close()
+        output_block.close()
+
+
+def parallel_valuation(states, keys, securities, base_currency_unit, dates, processes):
+    """valuation() of every security, one task per security over `processes` workers.
+
+    The snapshot states and the results live in shared memory, so each task
+    only pickles the names of the blocks.
+    """
+    output_shape = (3, len(dates), len(securities))
+    states_block = shared_memory.SharedMemory(create=True, size=states.nbytes)
+    output_block = shared_memory.SharedMemory(
+        create=True, size=int(np.prod(output_shape)) * 8)
+    try:
+        shared_states = np.ndarray(
+            states.shape, dtype=np.float64, buffer=states_block.buf)
+        shared_states[:] = states
+        tasks = [(states_block.name, states.shape, output_block.name, output_shape,
+                  keys.index(security), column, security, base_currency_unit.name, dates)
+                 for column, security in enumerate(securities)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            list(executor.map(security_history, tasks))
+        output = np.array(np.ndarray(
+            output_shape, dtype=np.float64, buffer=output_block.buf))
+        del shared_states
+    finally:
+        states_block.close()
+        states_block.unlink()
+        output_block.close()
+        output_block.unlink()
+    return output[0], output[1], output[2]
+
+
+@profiled("compute_history")
+def compute_history(portfolio, start_date, end_date, currency_unit=None, processes=None):
+    """Compute the historical value, return and return rate of a portfolio.
+
+    Returns a dict mapping each name of HISTORY_FUNCS to a DataFrame indexed
+    by date with a `Total` column and one column per security. Securities not
+    held yet at a date are NaN and dates before the first transaction are
+    dropped.
+
+    With `processes` > 1 (default: history_processes of config.ini) the
+    securities are valued in a pool of worker processes.
+    """
+    if processes is None:
+        processes = int(get_config()["Global"].get("history_processes", 0))
+    base_currency_unit = portfolio.base_currency_unit
+    dates = pd.date_range(start=start_date, end=end_date)
+    keys, states = portfolio.snapshots.states_at(dates)
+
+    securities = [key for key in keys if key != PORTFOLIO_KEY]
+    portfolio_invested = states[:, keys.index(PORTFOLIO_KEY),
+                                SNAPSHOT_FIELDS.index("total_invested")]
+
+    columns = [keys.index(key) for key in securities]
+    values = states[:, columns, SNAPSHOT_FIELDS.index("value")]
+    if (processes > 1) and (len(securities) > 1):
+        current_value, total_return, return_rate = parallel_valuation(
+            states, keys, securities, base_currency_unit, dates, processes)
+    else:
+        invested = states[:, columns, SNAPSHOT_FIELDS.index("total_invested")]
+        prices = np.column_stack(
+            [held_prices(security, base_currency_unit, dates, values[:, i])
+             for i, security in enumerate(securities)]) if securities else np.empty((len(dates), 0))
+        current_value, total_return, return_rate = valuation(
+            values, invested, prices)
+
+    # NaN values are securities not held yet, a NaN current value of a held
+    # security is a missing price: the totals of these dates are unknown
+    missing_price = np.isnan(current_value) & ~np.isnan(values) & (values != 0)
+    for security, n_missing in zip(securities, missing_price.sum(axis=0)):
+        if n_missing:
+            logging.warning(f"No {security} price within the staleness limit on {n_missing} "
+                            f"dates, the totals of these dates are NaN")
+    total_value = np.nansum(current_value, axis=1)
+    total_value[missing_price.any(axis=1)] = np.nan
+    total_return_all = total_value - portfolio_invested
+    return_rate_all = safe_divide(total_return_all, total_value)
+
+    kept = ~np.isnan(portfolio_invested)
+    if (currency_unit is not None) and (currency_unit.name != base_currency_unit.name):
+        rates = np.full(len(dates), np.nan)
+        if kept.any():
+            rates[kept] = base_currency_unit.get_price_series(
+                currency_unit, dates[kept]).values
+        current_value, total_return = current_value * \
+            rates[:, None], total_return * rates[:, None]
+        total_value, total_return_all = total_value * rates, total_return_all * rates
+
+    results = {}
+    for func_name, total, per_security in [("get_current_value", total_value, current_value),
+                                           ("get_total_return",
+                                            total_return_all, total_return),
+                                           ("get_return_rate", return_rate_all, return_rate)]:
+        frame = pd.DataFrame(per_security, index=dates, columns=securities)
+        frame.insert(0, TOTAL_COLUMN, total)
+        results[func_name] = frame[kept]
+    return results
@@ -0,0 +1,280 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from utils import read_data, save_data, file_lock, verify_data
+from profiling import PROFILER, profiled
+
+
+class LedgerStore():
+    """Local append-only copy of the Kraken ledger with a sync cursor.
+
+    The cursor is the id and time of the newest stored entry, only entries
+    after it are requested from Kraken (page by page) on each sync. It is
+    kept in a small `{name}_cursor.pkl` next to the ledger, which is only
+    read when its entries are needed: a sync without new entries reads the
+    cursor and makes a single Kraken call.
+    """
+
+    def __init__(self, path="ledger.pkl"):
+        self.path = path
+        self.cursor_path = os.path.splitext(path)[0] + "_cursor.pkl"
+        self.last_id = None
+        self._entries = None
+        self.entries_loaded = False
+        self.load_cursor()
+
+    @property
+    def entries(self):
+        if not self.entries_loaded:
+            self.load()
+        return self._entries
+
+    def load_cursor(self):
+        previous_id = self.last_id
+        stored = read_data(self.cursor_path, add_path_prefix=True)
+        if stored is None:
+            # Ledgers saved before the cursor file carry their own cursor
+            self.load()
+            if self.last_id is not None:
+                self.save_cursor()
+            return
+        stored = stored["value"]
+        self.last_id = stored["last_id"]
+        self.last_time = stored["last_time"]
+        self.recent_ids = stored["recent_ids"]
+        if self.last_id != previous_id:
+            # Synced by another process, the entries in memory are stale
+            self._entries, self.entries_loaded = None, False
+
+    def load(self):
+        self._entries = None
+        self.last_id = None
+        self.last_time = None
+        self.recent_ids = []
+        stored = read_data(self.path, add_path_prefix=True)
+        if stored is not None:
+            stored = stored["value"]
+            self._entries = stored["entries"]
+            self.last_id = stored["last_id"]
+            self.last_time = stored["last_time"]
+            self.recent_ids = list(self._entries.ledger_id[self._entries.index == self.last_time])
+        self.entries_loaded = True
+
+    def save(self):
+        save_data({"entries": self._entries, "last_id": self.last_id,
+                   "last_time": self.last_time}, self.path)
+        self.save_cursor()
+
+    def save_cursor(self):
+        save_data({"last_id": self.last_id, "last_time": self.last_time,
+                   "recent_ids": self.recent_ids}, self.cursor_path)
+
+    def fetch_new_entries(self, client):
+        pages = []
+        offset = 0
+        while True:
+            # Kraken returns the newest entries first, `start` is exclusive
+            page, count = query_ledger(client, ascending=True, start=self.last_id,
+                                       ofs=offset if offset else None)
+            if page.empty:
+                break
+            pages.append(page)
+            offset += len(page)
+            if offset >= count:
+                break
+        if not pages:
+            return pd.DataFrame()
+
+        new_entries = pd.concat(pages)
+        # Entries sharing the cursor timestamp can be returned twice
+        new_entries = new_entries[~new_entries.ledger_id.duplicated() &
+                                  ~new_entries.ledger_id.isin(self.recent_ids)]
+        return new_entries.sort_index(kind="stable")
+
+    @profiled("ledger_sync")
+    def sync(self, client):
+        # Another process may have synced while this one waited for the lock
+        with file_lock(os.path.join("./data", self.path)):
+            self.load_cursor()
+            return self._sync(client)
+
+    def _sync(self, client):
+        new_entries = self.fetch_new_entries(client)
+        if len(new_entries):
+            if self.entries is not None:
+                new_entries = new_entries[~new_entries.ledger_id.isin(self.entries.ledger_id)]
+        if len(new_entries):
+            if self._entries is None:
+                self._entries = new_entries
+            else:
+                self._entries = pd.concat([self._entries, new_entries])
+            self.last_id = new_entries.ledger_id.iloc[-1]
+            self.last_time = new_entries.index[-1]
+            self.recent_ids = list(self._entries.ledger_id[self._entries.index == self.last_time])
+            self.save()
+        logging.debug(
+            f"Ledger synced: {len(new_entries)} new entries, cursor = {self.last_id}")
+        return new_entries
+
+    def entries_after(self, ledger_id):
+        """Entries stored after `ledger_id`, None if the id is unknown"""
+        if (ledger_id is not None) and (ledger_id == self.last_id):
+            # Up to date, the entries are not read
+            return pd.DataFrame()
+        if self.entries is None:
+            return pd.DataFrame() if ledger_id is None else None
+        if ledger_id is None:
+            return self.entries
+        positions = np.flatnonzero(self.entries.ledger_id.values == ledger_id)
+        if not len(positions):
+            return None
+        return self.entries.iloc[positions[0] + 1:]
+
+
+def query_ledger(client, **kwargs):
+    with PROFILER.timer("network.kraken.ledger"):
+        return client.get_ledgers_info(**kwargs)
+
+
+def iter_ledger_pages(client, start=None):
+    """Yield the ledger entries after `start` (exclusive) page by page, oldest first.
+
+    Kraken pages the ledger newest first, so with `count` entries after the
+    cursor the oldest page starts at offset count - page size. The cursor
+    then moves to the last yielded entry. A count change between the two
+    calls means entries arrived meanwhile, and the offset is recomputed.
+    """
+    page, count = query_ledger(client, ascending=True, start=start)
+    page_size = len(page)
+    while page_size and (count > 0):
+        if count > page_size:
+            page, new_count = query_ledger(client, ascending=True, start=start,
+                                           ofs=count - page_size)
+            if new_count != count:
+                count = new_count
+                continue
+        if page.empty:
+            break
+        page = page.sort_index(kind="stable")
+        yield page
+        start = page.ledger_id.iloc[-1]
+        count -= len(page)
+        if 0 < count <= page_size:
+            page, count = query_ledger(client, ascending=True, start=start)
+
+
+class ChunkedLedgerStore():
+    """Ledger kept on disk in chunks of `chunk_size` entries, for streaming replays.
+
+    Syncing and reading only ever hold one chunk in memory, whatever the
+    length of the ledger. Chunks live in ./data/{directory}/ next to an
+    index with the sync cursor.
+    """
+
+    def __init__(self, directory="ledger", chunk_size=10000):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.load()
+
+    def load(self):
+        self.n_chunks = 0
+        self.last_id = None
+        self.last_time = None
+        stored = read_data(self.get_path("index.pkl"), add_path_prefix=True)
+        if stored is not None:
+            stored = stored["value"]
+            self.n_chunks = stored["n_chunks"]
+            self.last_id = stored["last_id"]
+            self.last_time = stored["last_time"]
+
+    def repair(self):
+        """Drop the chunks from the first corrupt one on, to be fetched again"""
+        for index in range(self.n_chunks):
+            if not verify_data(self.get_chunk_path(index), add_path_prefix=True):
+                logging.warning(f"Ledger chunk {index} is corrupt, truncating the ledger")
+                self.truncate(index)
+                break
+
+    def truncate(self, n_chunks):
+        self.n_chunks = n_chunks
+        self.last_id = self.last_time = None
+        if n_chunks:
+            chunk = self.read_chunk(n_chunks - 1)
+            self.last_id = chunk.ledger_id.iloc[-1]
+            self.last_time = chunk.index[-1]
+        self.save_index()
+
+    def save_index(self):
+        save_data({"n_chunks": self.n_chunks, "last_id": self.last_id,
+                   "last_time": self.last_time}, self.get_path("index.pkl"))
+
+    def get_path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def get_chunk_path(self, index):
+        return self.get_path(f"{index:06d}.pkl")
+
+    def read_chunk(self, index):
+        return read_data(self.get_chunk_path(index), add_path_prefix=True)["value"]
+
+    def save_chunk(self, index, chunk):
+        save_data(chunk, self.get_chunk_path(index))
+        self.n_chunks = max(self.n_chunks, index + 1)
+        self.last_id = chunk.ledger_id.iloc[-1]
+        self.last_time = chunk.index[-1]
+        self.save_index()
+
+    @profiled("ledger_sync")
+    def sync(self, client):
+        with file_lock(os.path.join("./data", self.get_path("index.pkl"))):
+            self.load()
+            self.repair()
+            return self._sync(client)
+
+    def _sync(self, client):
+        index, chunk = self.n_chunks, None
+        recent_ids = set()
+        if self.n_chunks:
+            # The last chunk is completed before new chunks are started
+            last_chunk = self.read_chunk(self.n_chunks - 1)
+            recent_ids = set(last_chunk.ledger_id)
+            if len(last_chunk) < self.chunk_size:
+                index, chunk = self.n_chunks - 1, last_chunk
+        n_new = 0
+        for page in iter_ledger_pages(client, start=self.last_id):
+            # Entries sharing the cursor timestamp can be returned twice
+            page = page[~page.ledger_id.isin(recent_ids)]
+            if page.empty:
+                continue
+            recent_ids = set(page.ledger_id)
+            n_new += len(page)
+            chunk = page if chunk is None else pd.concat([chunk, page])
+            while len(chunk) >= self.chunk_size:
+                self.save_chunk(index, chunk.iloc[:self.chunk_size])
+                index, chunk = index + 1, chunk.iloc[self.chunk_size:]
+        if (chunk is not None) and len(chunk):
+            self.save_chunk(index, chunk)
+        logging.debug(
+            f"Ledger synced: {n_new} new entries, cursor = {self.last_id}")
+        return n_new
+
+    def locate(self, ledger_id):
+        """(chunk, position) of the entry following `ledger_id`, None if unknown"""
+        if ledger_id is None:
+            return 0, 0
+        for index in range(self.n_chunks - 1, -1, -1):
+            positions = np.flatnonzero(
+                self.read_chunk(index).ledger_id.values == ledger_id)
+            if len(positions):
+                return index, positions[0] + 1
+        return None
+
+    def iter_chunks(self, start=(0, 0)):
+        index, position = start
+        for index in range(index, self.n_chunks):
+            chunk = self.read_chunk(index)
+            if position:
+                chunk, position = chunk.iloc[position:], 0
+            if len(chunk):
+                yield chunk
@@ -0,0 +1,146 @@
+import heapq
+import logging
+from collections import deque
+import pandas as pd
+from config import get_config
+
+AVERAGE, FIFO, LIFO, HIFO = "average", "fifo", "lifo", "hifo"
+COST_BASIS_METHODS = [AVERAGE, FIFO, LIFO, HIFO]
+DISPOSAL_COLUMNS = ["asset", "acquired", "disposed", "amount", "cost_basis", "proceeds", "gain"]
+# Amounts left unmatched below this are float rounding, not missing lots
+MATCH_TOLERANCE = 1e-9
+
+
+def get_cost_basis_method():
+    """Cost basis method of config.ini, the running average by default"""
+    method = get_config()["Global"].get("cost_basis", AVERAGE).lower()
+    if method not in COST_BASIS_METHODS:
+        raise ValueError(f"cost_basis must be one of {COST_BASIS_METHODS}, not {method}")
+    return method
+
+
+class Lot():
+    __slots__ = ("amount", "unit_cost", "timestamp")
+
+    def __init__(self, amount, unit_cost, timestamp):
+        self.amount = amount
+        self.unit_cost = unit_cost
+        self.timestamp = timestamp
+
+
+class LotQueue():
+    """Open lots of one asset, consumed in the order of the cost basis method.
+
+    FIFO and LIFO lots are kept in a deque and HIFO lots in a heap on the
+    unit cost. Every lot is added and fully consumed once, a disposal
+    only splits the last lot it touches: matching costs O(1) (deque) or
+    O(log n) (heap) amortized per lot.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.lots = [] if method == HIFO else deque()
+        self.count = 0
+
+    def __len__(self):
+        return len(self.lots)
+
+    def add(self, lot):
+        if self.method == HIFO:
+            # The counter breaks ties between lots of the same cost (oldest first)
+            heapq.heappush(self.lots, (-lot.unit_cost, self.count, lot))
+        else:
+            self.lots.append(lot)
+        self.count += 1
+
+    def peek(self):
+        if self.method == HIFO:
+            return self.lots[0][2]
+        return self.lots[0] if self.method == FIFO else self.lots[-1]
+
+    def pop(self):
+        if self.method == HIFO:
+            heapq.heappop(self.lots)
+        elif self.method == FIFO:
+            self.lots.popleft()
+        else:
+            self.lots.pop()
+
+    def match(self, amount):
+        """Consume `amount` from the open lots, returning the (lot, amount) matched.
+
+        The amount that no open lot covers is returned as well.
+        """
+        matched = []
+        while amount > 0 and self.lots:
+            lot = self.peek()
+            # A lot only left with rounding dust is consumed whole
+            if lot.amount <= amount * (1 + MATCH_TOLERANCE):
+                matched.append((lot, lot.amount))
+                amount -= lot.amount
+                self.pop()
+            else:
+                # Partial match: the lot stays in place with the rest
+                matched.append((lot, amount))
+                lot.amount -= amount
+                amount = 0
+        return matched, amount
+
+
+class LotBook():
+    """Per lot cost basis of every asset of a portfolio, with the realized gains.
+
+    Acquisitions open lots valued in the base currency, disposals close them
+    in the order of `method` (FIFO, LIFO or HIFO) and record one row per
+    matched lot in the disposals table.
+    """
+
+    def __init__(self, method):
+        if method not in (FIFO, LIFO, HIFO):
+            raise ValueError(f"Unknown lot matching method {method}")
+        self.method = method
+        self.queues = {}
+        self.disposals = []
+
+    def acquire(self, asset, amount, cost, timestamp):
+        """Open a lot of `amount` of `asset` costing `cost` in the base currency"""
+        if amount <= 0:
+            return
+        queue = self.queues.get(asset)
+        if queue is None:
+            queue = self.queues[asset] = LotQueue(self.method)
+        queue.add(Lot(amount, cost / amount, timestamp))
+
+    def dispose(self, asset, amount, proceeds, timestamp):
+        """Close `amount` of `asset` for `proceeds` in the base currency, returning the gain"""
+        if amount <= 0:
+            return 0
+        queue = self.queues.get(asset)
+        matched, unmatched = queue.match(amount) if queue is not None else ([], amount)
+        if unmatched > MATCH_TOLERANCE * amount:
+            # Amounts without a known acquisition are disposed at zero cost
+            logging.warning(f"No open lot for {unmatched} {asset} disposed at {timestamp}")
+            matched.append((Lot(unmatched, 0, None), unmatched))
+        gain = 0
+        for lot, lot_amount in matched:
+            cost_basis = lot_amount * lot.unit_cost
+            lot_proceeds = proceeds * lot_amount / amount
+            self.disposals.append((asset, lot.timestamp, timestamp, lot_amount,
+                                   cost_basis, lot_proceeds, lot_proceeds - cost_basis))
+            gain += lot_proceeds - cost_basis
+        return gain
+
+    def get_open_lots(self, asset):
+        """Open lots of `asset` as (timestamp, amount, unit_cost), in matching order"""
+        queue = self.queues.get(asset)
+        if queue is None:
+            return []
+        if self.method == HIFO:
+            lots = [lot for _, _, lot in sorted(queue.lots)]
+        else:
+            lots = list(queue.lots) if self.method == FIFO else list(reversed(queue.lots))
+        return [(lot.timestamp, lot.amount, lot.unit_cost) for lot in lots]
+
+    def get_disposals(self):
+        """Realized gains table, one row per (disposal, matched lot)"""
+        return pd.DataFrame(self.disposals, columns=DISPOSAL_COLUMNS)
@@ -1,33 +1,93 @@
-from config import config, client
+from config import get_config, get_client
 import logging
 from currencies import CurrencyUnit
 from portfolio import Portfolio
+from tracing import TRACER
+from profiling import PROFILER
+from lots import get_cost_basis_method, AVERAGE
 import argparse
-import matplotlib
-matplotlib.use("TkAgg")
-logging.basicConfig(filename='run_log.log', level=logging.DEBUG, filemode='w')
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Displays profits from portfolio')
     parser.add_argument("--currency", type=str, default="CHF")
+    parser.add_argument("--report-currencies", type=str, nargs="+", default=None,
+                        help="report in each of these currencies from a single replay")
+    parser.add_argument("--gains-output", type=str, default=None,
+                        help="write the realized gains per lot to this CSV file (cost_basis of config.ini)")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="only display the portfolio, matplotlib is not imported")
+    parser.add_argument("--backend", type=str, default="TkAgg",
+                        help="matplotlib backend used for the plots")
+    parser.add_argument("--stream", action="store_true",
+                        help="replay the ledger chunk by chunk, for very long ledgers")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time spent in each stage at the end of the run")
+    parser.add_argument("--profile-output", type=str, default=None,
+                        help="also write the stage breakdown to this JSON file")
+    parser.add_argument("--cprofile", type=str, default=None,
+                        help="dump cProfile statistics of the whole run to this file (pstats format)")
     args = parser.parse_args()
     return args
 
 
 def main(args):
+    config = get_config()
+    logging.basicConfig(filename='run_log.log', level=config["Global"].get("log_level", "INFO"),
+                        filemode='w')
+    TRACER.configure_from(config)
+    if args.gains_output and get_cost_basis_method() == AVERAGE:
+        raise SystemExit("--gains-output needs cost_basis = fifo, lifo or hifo in config.ini")
+    client = get_client()
     if client.api.key is None:
         client.api.key = input("Enter API key:")
     if client.api.secret is None:
         client.api.secret = input("Enter secret:")
     currency = config["Portfolio"].get("currency", args.currency)
-    portfolio = Portfolio.from_kraken_ledger(currency)
+    if args.stream:
+        portfolio = Portfolio.from_kraken_ledger_stream(currency)
+    else:
+        portfolio = Portfolio.from_kraken_ledger(currency)
+
+    report_currencies = args.report_currencies
+    if report_currencies is None and config["Portfolio"].get("report_currencies"):
+        report_currencies = [name.strip() for name in
+                             config["Portfolio"]["report_currencies"].split(",")]
+    if report_currencies:
+        portfolio.display_currencies(
+            [CurrencyUnit.create_currency_unit(name) for name in report_currencies])
+    else:
+        portfolio.display(
+            currency_unit=CurrencyUnit.create_currency_unit(currency))
+    if args.gains_output:
+        portfolio.get_disposals().to_csv(args.gains_output, index=False)
+    if not args.no_plot:
+        import plotting
+        plotting.use_backend(args.backend)
+        portfolio.plot_old_values()
+        portfolio.plot_old_values(func_name="get_total_return")
+
+
+def run(args):
+    if args.profile or args.profile_output:
+        PROFILER.enable()
+    profile = None
+    if args.cprofile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        main(args)
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.cprofile)
+        if args.profile:
+            print(PROFILER.format_report())
+        if args.profile_output:
+            PROFILER.export(args.profile_output)
 
-    portfolio.display(
-        currency_unit=CurrencyUnit.create_currency_unit(currency))
-    portfolio.plot_old_values()
-    portfolio.plot_old_values(func_name="get_total_return")
 
 if __name__ == "__main__":
-    main(parse_args())
+    run(parse_args())
@@ -0,0 +1,22 @@
+import matplotlib.pyplot as plt
+from profiling import profiled
+
+
+def use_backend(backend):
+    plt.switch_backend(backend)
+
+
+@profiled("plot_values")
+def plot_values(total_values, dates, per_currency_values=None, title=None):
+    plt.figure(figsize=(10, 10))
+    plt.plot(dates[::-1], total_values[::-1], label="Total")
+    if per_currency_values is not None:
+        for key, currency_values_dates in per_currency_values.items():
+            currency_dates, currency_values = zip(*currency_values_dates)
+            plt.plot(currency_dates[::-1], currency_values[::-1], label=key)
+
+    plt.legend()
+    plt.title(title)
+    plt.tight_layout()
+    plt.draw()
+    plt.show()
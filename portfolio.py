@@ -1,19 +1,25 @@
-from currencies import CryptoCurrency, FiatCurrency, CurrencyUnit
+from currencies import CryptoCurrency, FiatCurrency, CurrencyUnit, fetch_latest_prices
+from currencies import MemoizedAggregates, memoized
+import numpy as np
 import pandas as pd
 import numbers
-from utils import FIAT_CURRENCIES
 import time
-import krakenex
-from pykrakenapi import KrakenAPI
-from utils import get_cached, save_data, ts_format, read_data, str2date
+from utils import save_data, ts_format, read_data, str2date, get_account_path
 import logging
-from config import client, config
-import copy
+from config import get_client, get_config
 from collections import defaultdict
-import matplotlib.pyplot as plt
-
-
-class Portfolio():
+from snapshots import SnapshotStore, SNAPSHOT_FIELDS, PORTFOLIO_KEY
+from history import compute_history, HISTORY_FUNCS, TOTAL_COLUMN
+from prefetch import prefetch_prices
+from ledger_store import LedgerStore, ChunkedLedgerStore
+from transactions import parse_ledger, iter_transactions, DEPOSIT, TRADE
+from tracing import TRACER
+from profiling import profiled
+from lots import LotBook, AVERAGE, get_cost_basis_method
+from reporting import metrics_table, project_metrics, format_metrics
+
+
+class Portfolio(MemoizedAggregates):
     def __init__(self, base_currency_unit):
         self.securities = {}
         self.base_currency_unit = base_currency_unit
@@ -21,13 +27,23 @@ class Portfolio():
         self.last_update_time = None
         self.creation_time = ts_format()
         self.first_transaction_time = None
-        self.last_checkpoint = None
+        self.snapshots = SnapshotStore()
+        self.last_ledger_id = None
         self.realized_profit = 0
         self.total_invested_up_now = 0
+        # Lots are tracked next to the running average unless it is the method
+        self.cost_basis = get_cost_basis_method()
+        self.lots = None if self.cost_basis == AVERAGE else LotBook(self.cost_basis)
+
+    def state(self):
+        return {"total_invested": self._total_invested, "total_invested_up_now": self.total_invested_up_now,
+                "realized_profit": self.realized_profit, "securities": len(self.securities),
+                "last_update_time": self.last_update_time}
 
     def update_time(self, ts=None):
         self.last_update_time = ts_format(ts)
 
+    @memoized
     def get_total_return(self, currency_unit=None, from_currency=False, date=None):
         if currency_unit is None:
             currency_unit = self.base_currency_unit
@@ -38,6 +54,7 @@ class Portfolio():
                 currency_unit=currency_unit, from_currency=from_currency)
             return self.get_current_value(currency_unit, date=date) - total_invested
 
+    @memoized
     def get_return_rate(self, from_currency=False, date=None):
         result = self.get_total_return(from_currency=from_currency, date=date)
         denom = self.get_current_value(date=date)
@@ -47,6 +64,7 @@ class Portfolio():
 
         return result
 
+    @memoized
     def get_current_value(self, currency_unit=None, date=None):
         if currency_unit is None:
             currency_unit = self.base_currency_unit
@@ -68,42 +86,46 @@ class Portfolio():
     def top_up(self, value, currency_unit, fee=0, avg_base_price=None,
                avg_base_price_currency_unit=None, update_avg_price=True,
                timestamp=None):
-        logging.debug(f"Top up of Portfolio started")
-        logging.debug(f"\t top up Args: {locals()}")
         if currency_unit.name not in self.securities:
             self.securities[currency_unit.name] = currency_unit.create_currency(
                 self.base_currency_unit)
 
+        # The lot of a deposit costs its value at the deposit date
+        lot_price = avg_base_price
         if avg_base_price is None:
             avg_base_price = currency_unit.convert(self.base_currency_unit, 1)
+            if (self.lots is not None) and \
+                    not currency_unit.is_same_asset(self.base_currency_unit.name):
+                lot_price = currency_unit.convert(self.base_currency_unit, 1,
+                                                  date=timestamp.normalize())
         elif avg_base_price_currency_unit is not None:
             avg_base_price = avg_base_price_currency_unit.convert(
                 self.base_currency_unit, avg_base_price)
+            lot_price = avg_base_price
 
+        self.invalidate()
         self.securities[currency_unit.name].top_up(value, fee=fee, avg_base_price=avg_base_price,
                                                    avg_base_price_currency_unit=avg_base_price_currency_unit,
                                                    update_avg_price=update_avg_price,
                                                    date=timestamp.normalize())
         self._total_invested += avg_base_price*value
         self.total_invested_up_now += avg_base_price*value
+        if (self.lots is not None) and \
+                not currency_unit.is_same_asset(self.base_currency_unit.name):
+            self.lots.acquire(currency_unit.name, value - fee, lot_price*value, timestamp)
 
-        if self.last_checkpoint is None:
+        if self.first_transaction_time is None:
             self.first_transaction_time = timestamp
-        self.last_checkpoint = copy.deepcopy(self)
+        self.snapshots.record(timestamp, self, keys=[currency_unit.name])
         self.update_time(timestamp)
 
-        logging.debug(f"Top up finished {self}")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
+        if TRACER.enabled:
+            TRACER.emit("portfolio.top_up", asset=currency_unit.name, top_up_value=value,
+                        fee=fee, avg_base_price=avg_base_price, **self.state())
 
     def trade(self, value_sold, sell_currency_unit,
               value_bought, buy_currency_unit, sell_fee=0, buy_fee=0,
               timestamp=None):
-        logging.debug(f"Trade order started")
-        logging.debug(f"\t Trade Args: {locals()}")
-        logging.debug(f"\t Current securities: {self.securities}")
         if sell_currency_unit.name not in self.securities:
             raise ValueError(f"No {sell_currency_unit.name} to sell")
         sell_currency = self.securities[sell_currency_unit.name]
@@ -114,6 +136,7 @@ class Portfolio():
             self.securities[buy_currency_unit.name] = new_currency
         buy_currency = self.securities[buy_currency_unit.name]
 
+        self.invalidate()
         realized_profit, profit_currency_unit = sell_currency.sell(buy_currency,
                                                                    value_sold,
                                                                    value_bought,
@@ -121,21 +144,48 @@ class Portfolio():
                                                                    buy_fee=buy_fee,
                                                                    date=timestamp.normalize()
                                                                    )
-        logging.debug(f"PORTFOLIO PROFIT {realized_profit}")
 
         self.realized_profit += profit_currency_unit.convert(self.base_currency_unit,
                                                              realized_profit)
-        logging.debug(f"TOTAL PORTFOLIO PROFIT {self.realized_profit}")
+        if self.lots is not None:
+            self.trade_lots(value_sold, sell_currency_unit, value_bought, buy_currency_unit,
+                            sell_fee=sell_fee, buy_fee=buy_fee, timestamp=timestamp)
 
-        if self.last_checkpoint is None:
+        if self.first_transaction_time is None:
             self.first_transaction_time = timestamp
-        self.last_checkpoint = copy.deepcopy(self)
+        self.snapshots.record(timestamp, self,
+                              keys=[sell_currency_unit.name, buy_currency_unit.name])
         self.update_time(timestamp)
-        logging.debug(f"Trade order finished {self}")
-        filtered_global_var = filter(lambda x: not (
-            x.startswith("__") or callable(getattr(self, x))), dir(self))
-        logging.debug(
-            f"Portfolio State {list(map(lambda x: (x,getattr(self,x)),filtered_global_var))}")
+        if TRACER.enabled:
+            TRACER.emit("portfolio.trade", sell_asset=sell_currency_unit.name, value_sold=value_sold,
+                        buy_asset=buy_currency_unit.name, value_bought=value_bought,
+                        trade_realized_profit=realized_profit, **self.state())
+
+    def trade_lots(self, value_sold, sell_currency_unit, value_bought, buy_currency_unit,
+                   sell_fee=0, buy_fee=0, timestamp=None):
+        """Dispose of the sold lots and open the bought one.
+
+        Fees are part of the cost of the bought lot: the sold lots, fee
+        included, are disposed at the value of what they bought. Sold for
+        the base currency, they are disposed at the amount received net of
+        its fee. The base currency has no lots, spending or receiving it
+        realizes nothing.
+        """
+        base_currency = self.base_currency_unit.name
+        spent = value_sold + sell_fee
+        if sell_currency_unit.is_same_asset(base_currency):
+            cost = spent
+        elif buy_currency_unit.is_same_asset(base_currency):
+            self.lots.dispose(sell_currency_unit.name, spent, value_bought - buy_fee, timestamp)
+            return
+        else:
+            cost = buy_currency_unit.convert(self.base_currency_unit, value_bought,
+                                             date=timestamp.normalize())
+            if value_sold:
+                cost *= spent / value_sold
+            self.lots.dispose(sell_currency_unit.name, spent, cost, timestamp)
+        if not buy_currency_unit.is_same_asset(base_currency):
+            self.lots.acquire(buy_currency_unit.name, value_bought - buy_fee, cost, timestamp)
 
     def get_total_invested_up_now(self, currency_unit=None, from_currency=False):
         if from_currency:
@@ -153,6 +203,7 @@ class Portfolio():
             ret = self.base_currency_unit.convert(currency_unit, ret)
         return ret
 
+    @memoized
     def get_all_return_rate(self, from_currency=False):
         if from_currency:
             raise NotImplementedError
@@ -168,6 +219,36 @@ class Portfolio():
             return 0
         return self.realized_profit / denom
 
+    def from_snapshot_state(self, state):
+        """Rebuild a Portfolio holding the given SnapshotStore state"""
+        portfolio = self.__class__(self.base_currency_unit)
+        portfolio.snapshots = None
+        portfolio.lots = None
+        for key, values in state.items():
+            fields = dict(zip(SNAPSHOT_FIELDS, values))
+            if key == PORTFOLIO_KEY:
+                portfolio._total_invested = fields["total_invested"]
+                portfolio.total_invested_up_now = fields["total_invested_up_now"]
+                portfolio.realized_profit = fields["realized_profit"]
+                continue
+            currency = CurrencyUnit.create_currency_unit(
+                key).create_currency(self.base_currency_unit)
+            for field, value in fields.items():
+                setattr(currency, field, value)
+            currency.compute_avg_base_price()
+            portfolio.securities[key] = currency
+        return portfolio
+
+    def get_disposals(self):
+        """Realized gains per disposed lot, see lots.LotBook.get_disposals"""
+        if self.lots is None:
+            raise ValueError("Per lot gains need cost_basis = fifo, lifo or hifo in config.ini")
+        return self.lots.get_disposals()
+
+    def get_state_at(self, date):
+        return self.from_snapshot_state(self.snapshots.state_at(date))
+
+    @profiled("get_old_values")
     def get_old_values(self, currency_unit=None, per_currency=True,
                        start_date="2021-04-01", end_date=None,
                        func_name="get_return_rate"):
@@ -178,40 +259,48 @@ class Portfolio():
             per_currency_dict = defaultdict(list)
         if self.last_update_time is not None:
             end_date = str2date(end_date)
-            start_date = str2date(start_date)
-            for date in pd.date_range(start=start_date, end=end_date)[::-1]:
-
-                if (date < pd.to_datetime(self.last_update_time).normalize()):
-                    if self.last_checkpoint is not None:
-                        tmp_res = self.last_checkpoint.get_old_values(currency_unit=currency_unit,
-                                                                      end_date=date, start_date=start_date,
-                                                                      per_currency=per_currency,
-                                                                      func_name=func_name
-                                                                      )
-                        if per_currency:
-                            rates_tmp, dates_tmp, per_currency_dict_tmp = tmp_res
-                        else:
-                            rates_tmp, dates_tmp = tmp_res
-
-                        rates += rates_tmp
-                        dates += dates_tmp
-
-                        # extend
-                        for key, values in per_currency_dict_tmp.items():
-                            per_currency_dict[key].extend(values)
-                    break
-                else:
-                    rates.append(getattr(self, func_name)(date=date))
-                    dates.append(date)
-                    if per_currency:
-                        for name, currency in self.securities.items():
-                            per_currency_dict[name].append((date,
-                                                            getattr(currency, func_name)(date=date)))
+            start_date = max(str2date(start_date),
+                             pd.to_datetime(self.first_transaction_time).normalize())
+            if func_name in HISTORY_FUNCS:
+                return self._get_old_values_vectorized(currency_unit, per_currency,
+                                                       start_date, end_date, func_name)
+            date_range = pd.date_range(start=start_date, end=end_date)[::-1]
+            # Consecutive dates sharing the same number of ledger entries
+            # share the same state, so each state is rebuilt only once
+            counts = [self.snapshots.count_until(date) for date in date_range]
+            state_portfolio, state_count = None, None
+            for date, count in zip(date_range, counts):
+                if count != state_count:
+                    state_portfolio = self.from_snapshot_state(
+                        self.snapshots.state_from_count(count))
+                    state_count = count
+                rates.append(getattr(state_portfolio, func_name)(date=date))
+                dates.append(date)
+                if per_currency:
+                    for name, currency in state_portfolio.securities.items():
+                        per_currency_dict[name].append((date,
+                                                        getattr(currency, func_name)(date=date)))
         if per_currency:
             return rates, dates, per_currency_dict
         else:
             return rates, dates
 
+    def _get_old_values_vectorized(self, currency_unit, per_currency,
+                                   start_date, end_date, func_name):
+        history = compute_history(self, start_date, end_date,
+                                  currency_unit=currency_unit)[func_name][::-1]
+        rates = history[TOTAL_COLUMN].tolist()
+        dates = list(history.index)
+        if not per_currency:
+            return rates, dates
+        per_currency_dict = defaultdict(list)
+        for name in history.columns.drop(TOTAL_COLUMN):
+            values = history[name].dropna()
+            # Like the scalar path, only securities held in the window are listed
+            if len(values):
+                per_currency_dict[name].extend(zip(values.index, values.tolist()))
+        return rates, dates, per_currency_dict
+
     def plot_old_values(self, currency_unit=None, per_currency=True,
                         start_date="2021-04-01", end_date=None,
                         func_name="get_return_rate", title=None):
@@ -224,22 +313,28 @@ class Portfolio():
         else:
             total_values, dates = res
         
-        plt.figure(figsize=(10, 10))
-        plt.plot(dates[::-1], total_values[::-1], label="Total")
-        if per_currency:
-            for key, currency_values_dates in per_currency_values.items():
-                dates,currency_values = zip(*currency_values_dates)
-                plt.plot(dates[::-1], currency_values[::-1], label=key)
-
-        plt.legend()
-        plt.title(title if title is not None else func_name)
-        plt.tight_layout()
-        plt.draw()
-        plt.show()
-
+        # matplotlib is only imported when a plot is requested
+        from plotting import plot_values
+        plot_values(total_values, dates, per_currency_values if per_currency else None,
+                    title=title if title is not None else func_name)
+
+    def fetch_latest_prices(self, currency_unit=None, refresh=False):
+        """Warm the latest price cache for every security in one round trip"""
+        names = list(self.securities) + [self.base_currency_unit.name]
+        to_units = {self.base_currency_unit.name: self.base_currency_unit}
+        if currency_unit is not None:
+            to_units[currency_unit.name] = currency_unit
+        for to in to_units.values():
+            try:
+                fetch_latest_prices(names, to, refresh=refresh)
+            except Exception as e:
+                logging.debug(f"Batched latest prices to {to.name} failed: {e}")
+
+    @profiled("display")
     def display(self, verbose=True, tabulation="", currency_unit=None, tabulation_char="\t"):
         if currency_unit is None:
             currency_unit = self.base_currency_unit
+        self.fetch_latest_prices(currency_unit)
         current_val = self.get_current_value(currency_unit=currency_unit)
         total_invested = self.get_total_invested(currency_unit)
         total_invested_up_now = self.get_total_invested_up_now(
@@ -273,84 +368,172 @@ class Portfolio():
 
         return display_str
 
-    @classmethod
-    def from_kraken_ledger(clf, base_currency_ticker):
-        ttl = int(config["Global"].get("ttl", 3600))
-        cached_portfolio_path = "cached_portfolio.pkl"
-        cached_ledger_path = "cached_ledger.pkl"
+    @memoized
+    def get_metrics(self):
+        """Metrics table of the portfolio in the base currency, see reporting.metrics_table"""
+        return metrics_table(self)
+
+    @profiled("display_currencies")
+    def display_currencies(self, currency_units, verbose=True, tabulation="", tabulation_char="\t"):
+        """Display the portfolio in each of `currency_units` from one metrics table.
+
+        Returns the reports keyed by currency name. Unlike calling display once
+        per currency, securities are only converted to the base currency.
+        """
+        self.fetch_latest_prices()
+        projected = project_metrics(self.get_metrics(), self.base_currency_unit, currency_units)
+        reports = {}
+        for name, metrics in projected.items():
+            reports[name] = format_metrics(metrics, name, tabulation=tabulation,
+                                           tabulation_char=tabulation_char)
+            if verbose:
+                print(reports[name])
+        return reports
+
+    @profiled("replay")
+    def replay(self, transactions):
+        currency_units = [CurrencyUnit.create_currency_unit(
+            asset) for asset in transactions.assets]
+        # Trades convert the bought asset at the trade date: resolve all of
+        # these stored prices with one lookup per asset
+        trades = transactions.records[transactions.records["kind"] == TRADE]
+        for asset_id in np.unique(trades["buy_asset"]):
+            currency_units[asset_id].preload_prices(
+                self.base_currency_unit, trades["timestamp"][trades["buy_asset"] == asset_id])
+        for record, ledger_id in zip(transactions.records, transactions.ledger_ids):
+            timestamp = pd.Timestamp(record["timestamp"])
+            if record["kind"] == DEPOSIT:
+                self.top_up(record["buy_amount"], currency_units[record["buy_asset"]],
+                            fee=record["buy_fee"], timestamp=timestamp)
+            elif record["kind"] == TRADE:
+                self.trade(record["sell_amount"], currency_units[record["sell_asset"]],
+                           record["buy_amount"], currency_units[record["buy_asset"]],
+                           sell_fee=record["sell_fee"], buy_fee=record["buy_fee"],
+                           timestamp=timestamp)
+            else:
+                # Withdrawals are not tracked by the portfolio
+                continue
+            self.last_ledger_id = ledger_id
+        # Entries dropped by parse_ledger (withdrawals, staking...) after the
+        # last transaction must not be replayed again by the next sync
+        if transactions.last_ledger_id is not None:
+            self.last_ledger_id = transactions.last_ledger_id
+
+    @staticmethod
+    def get_cached_path(base_currency_ticker, account=None):
+        return get_account_path(account, f"cached_portfolio_{base_currency_ticker}.pkl")
+
+    @staticmethod
+    def read_cached(cached_portfolio_path):
         portfolio = read_data(cached_portfolio_path, add_path_prefix=True)
-        trades_history = get_cached(cached_ledger_path, expiration=ttl)
-        if portfolio is None:
-            start = None
-            portfolio = clf(
-                CurrencyUnit.create_currency_unit(base_currency_ticker))
-        else:
+        if portfolio is not None and not hasattr(portfolio["value"], "snapshots"):
+            # Portfolios cached with the old checkpoint chain are rebuilt
+            logging.debug("Discarding cached portfolio without snapshot store")
+            portfolio = None
+        elif portfolio is not None and \
+                getattr(portfolio["value"], "cost_basis", AVERAGE) != get_cost_basis_method():
+            logging.debug("Discarding cached portfolio built with another cost basis method")
+            portfolio = None
+        return portfolio
+
+    @classmethod
+    @profiled("from_kraken_ledger")
+    def from_kraken_ledger(clf, base_currency_ticker, client=None, account=None):
+        portfolio, trades_history = clf.load_from_ledger(
+            base_currency_ticker, client=client, account=account)
+
+        if trades_history.empty:
+            return portfolio
+
+        portfolio.update_from_ledger(trades_history, account=account)
+
+        return portfolio
+
+    @classmethod
+    def load_from_ledger(clf, base_currency_ticker, client=None, account=None):
+        """Cached portfolio of `account` and the synced ledger entries it has not replayed"""
+        cached_portfolio_path = clf.get_cached_path(base_currency_ticker, account)
+        portfolio = clf.read_cached(cached_portfolio_path)
+
+        ledger_store = LedgerStore(path=get_account_path(account, "ledger.pkl"))
+        ledger_store.sync(get_client() if client is None else client)
 
+        trades_history = None
+        if portfolio is not None:
             portfolio = portfolio["value"]
-            start = portfolio.last_update_time
             logging.debug(
-                f"Loaded portfolio from cache with last update time = {start}")
+                f"Loaded portfolio from cache with last update time = {portfolio.last_update_time}")
+            last_ledger_id = getattr(portfolio, "last_ledger_id", None)
+            if last_ledger_id is not None:
+                trades_history = ledger_store.entries_after(last_ledger_id)
+            elif ledger_store.entries is not None and portfolio.last_update_time is not None:
+                trades_history = ledger_store.entries[ledger_store.entries.index >
+                                                      portfolio.last_update_time]
+            if trades_history is None:
+                logging.debug("Cached portfolio does not match the ledger store")
+                portfolio = None
+        if portfolio is None:
+            portfolio = clf(
+                CurrencyUnit.create_currency_unit(base_currency_ticker))
+            trades_history = ledger_store.entries_after(None)
+        return portfolio, trades_history
 
-        if trades_history is None:
+    def update_from_ledger(self, trades_history, account=None, prefetch=True):
+        """Replay new ledger entries, prefetching their prices, and save the portfolio"""
+        if prefetch:
+            prefetch_prices(trades_history, self.base_currency_unit.name)
+        self.replay(parse_ledger(trades_history))
+        save_data(self, self.get_cached_path(self.base_currency_unit.name, account))
 
-            trades_history, _ = client.get_ledgers_info(
-                ascending=True, start=start.value if start is not None else None)
-            save_data(trades_history, cached_ledger_path)
-        else:
-            trades_history = trades_history["value"]
-
-        if portfolio.last_update_time is not None:
-            trades_history = trades_history[trades_history.index >
-                                            portfolio.last_update_time]
-
-        last_entry = None
-        for ts, entry in trades_history.iterrows():
-
-            logging.debug(str((ts, entry.asset, portfolio.securities)))
-            if last_entry is not None and entry.type != "trade":
-                raise ValueError("Corrupted ledger")
-            if entry.type == "deposit":
-
-                asset_name = entry.asset
-                currencies_unit = CurrencyUnit.create_currency_unit(asset_name)
-                portfolio.top_up(abs(entry.amount), currencies_unit, fee=abs(entry.fee),
-                                 timestamp=ts
-                                 )
-            elif entry.type == "trade":
-                if last_entry is None:
-                    last_entry = entry
-                else:
-                    if last_entry.amount < 0:
-                        value_sold = abs(last_entry.amount)
-                        sell_currency_unit = CurrencyUnit.create_currency_unit(
-                            last_entry.asset)
-                        sell_fee = last_entry.fee
-                        if entry.amount < 0:
-                            raise ValueError("Corrupted ledger")
-                        value_bought = entry.amount
-                        buy_currency_unit = CurrencyUnit.create_currency_unit(
-                            entry.asset)
-                        buy_fee = entry.fee
-                    else:
-                        value_sold = abs(entry.amount)
-                        sell_currency_unit = CurrencyUnit.create_currency_unit(
-                            entry.asset)
-                        sell_fee = entry.fee
-                        if last_entry.amount < 0:
-                            raise ValueError("Corrupted ledger")
-                        value_bought = last_entry.amount
-                        buy_currency_unit = CurrencyUnit.create_currency_unit(
-                            last_entry.asset)
-                        buy_fee = last_entry.fee
-
-                    last_entry = None
-
-                    timestamp = ts
-                    portfolio.trade(value_sold, sell_currency_unit,
-                                    value_bought, buy_currency_unit, sell_fee=sell_fee, buy_fee=buy_fee,
-                                    timestamp=timestamp)
-
-        save_data(portfolio, cached_portfolio_path)
+    @classmethod
+    @profiled("from_kraken_ledger_stream")
+    def from_kraken_ledger_stream(clf, base_currency_ticker, chunk_size=None, checkpoint_every=None):
+        """Same as from_kraken_ledger, streaming the ledger chunk by chunk.
+
+        The ledger is synced to a ChunkedLedgerStore and replayed one chunk at
+        a time, so the ledger rows held in memory never exceed a chunk. The
+        portfolio is saved every `checkpoint_every` chunks, an interrupted
+        replay resumes from the last checkpoint.
+        """
+        config = get_config()["Global"]
+        if chunk_size is None:
+            chunk_size = int(config.get("ledger_chunk_size", 10000))
+        if checkpoint_every is None:
+            checkpoint_every = int(config.get("checkpoint_every", 10))
+        cached_portfolio_path = clf.get_cached_path(base_currency_ticker)
+        portfolio = clf.read_cached(cached_portfolio_path)
+
+        ledger_store = ChunkedLedgerStore(chunk_size=chunk_size)
+        ledger_store.sync(get_client())
+
+        start = None
+        if portfolio is not None:
+            portfolio = portfolio["value"]
+            start = ledger_store.locate(getattr(portfolio, "last_ledger_id", None))
+            if start is None:
+                logging.debug("Cached portfolio does not match the ledger store")
+                portfolio = None
+        if portfolio is None:
+            portfolio = clf(
+                CurrencyUnit.create_currency_unit(base_currency_ticker))
+            start = (0, 0)
+
+        def prefetched(chunks):
+            for chunk in chunks:
+                prefetch_prices(chunk, portfolio.base_currency_unit.name)
+                yield chunk
+
+        replayed = 0
+        for transactions in iter_transactions(prefetched(ledger_store.iter_chunks(start)),
+                                              chunk_size=chunk_size):
+            portfolio.replay(transactions)
+            replayed += 1
+            if replayed % checkpoint_every == 0:
+                save_data(portfolio, cached_portfolio_path)
+                logging.info(
+                    f"Checkpoint after {replayed} ledger chunks, last entry {portfolio.last_ledger_id}")
+        if replayed:
+            save_data(portfolio, cached_portfolio_path)
 
         return portfolio
 
@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import get_config, new_client
+from currencies import CurrencyUnit, PRICE_STORE, fetch_latest_prices
+from profiling import profiled
+
+# (burst, calls per second) of the Kraken call counter for each tier
+KRAKEN_TIER_RATES = {
+    "Starter": (15, 1 / 3),
+    "Intermediate": (20, 1 / 2),
+    "Pro": (20, 1.0),
+    "None": (1, float("inf")),
+}
+
+
+class RateLimiter():
+    """Thread-safe token bucket shared by all prefetch workers"""
+
+    def __init__(self, burst, rate):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_tier(cls, tier):
+        burst, rate = KRAKEN_TIER_RATES.get(
+            tier, KRAKEN_TIER_RATES["Intermediate"])
+        return cls(burst, rate)
+
+    def acquire(self):
+        if self.rate == float("inf"):
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedClient():
+    """Wraps a KrakenAPI client so that every call first acquires the limiter"""
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def limited_call(*args, **kwargs):
+            self.limiter.acquire()
+            return attr(*args, **kwargs)
+        return limited_call
+
+
+def collect_price_requests(trades_history, base_currency):
+    """List the (asset, base_currency, dates) rates needed to replay a ledger.
+
+    `dates` is None for the latest quote used by top ups and display, or the
+    trade dates at which the bought asset is converted to the base currency.
+    Requests already satisfied by the price store are left out.
+    """
+    expiration = float(get_config()["Global"].get("ttl", 3600))
+    price_requests = []
+    bought = trades_history[(trades_history.type == "trade") &
+                            (trades_history.amount > 0)]
+    for asset in trades_history.asset.unique():
+        if asset == base_currency:
+            continue
+        if PRICE_STORE.get_latest(asset, base_currency, expiration=expiration) is None:
+            price_requests.append((asset, base_currency, None))
+        dates = bought.index[bought.asset == asset].normalize().unique()
+        if len(dates) and not PRICE_STORE.covers(asset, base_currency, dates):
+            price_requests.append((asset, base_currency, dates))
+    return price_requests
+
+
+@profiled("prefetch_prices")
+def prefetch_prices(trades_history, base_currency, workers=None, client_factory=None):
+    """Fetch every rate needed to replay `trades_history` concurrently.
+
+    Kraken calls of all workers go through one RateLimiter built from the
+    configured tier. Failures are only logged: the replay falls back to
+    fetching the missing rates lazily.
+    """
+    price_requests = collect_price_requests(trades_history, base_currency)
+    if not price_requests:
+        return
+    config = get_config()
+    if workers is None:
+        workers = int(config["API"].get("prefetch_workers", 4))
+    if client_factory is None:
+        client_factory = new_client
+
+    limiter = RateLimiter.from_tier(config["API"].get("tier", "Intermediate"))
+    local = threading.local()
+
+    def fetch(price_request):
+        asset, to, dates = price_request
+        # KrakenAPI keeps per instance call counters, so each worker has its own
+        if not hasattr(local, "client"):
+            local.client = RateLimitedClient(client_factory(), limiter)
+        try:
+            if dates is None:
+                # All latest quotes are fetched by a single batched request
+                fetch_latest_prices(asset, to, kraken_client=local.client)
+            else:
+                CurrencyUnit.create_currency_unit(asset).fetch_history(
+                    to, dates, kraken_client=local.client)
+        except Exception as e:
+            logging.debug(f"Prefetch of {asset}/{to} failed: {e}")
+
+    latest_assets = [asset for asset, _, dates in price_requests if dates is None]
+    price_requests = [price_request for price_request in price_requests
+                      if price_request[2] is not None]
+    if latest_assets:
+        price_requests.append((latest_assets, base_currency, None))
+
+    logging.debug(
+        f"Prefetching {len(price_requests)} exchange rates with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(fetch, price_requests))
@@ -0,0 +1,63 @@
+import time
+import threading
+from config import get_config
+from collections import OrderedDict
+
+
+class PriceCache():
+    """Bounded in-memory LRU cache of exchange rates keyed by (from, to, date).
+
+    Entries stored with a ttl (latest quotes) expire, historical closes are
+    kept until evicted. The size defaults to `Global.price_cache_size`.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_max_size(self):
+        if self.max_size is None:
+            self.max_size = int(get_config()["Global"].get(
+                "price_cache_size", 100000))
+        return self.max_size
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if (expires_at is None) or (expires_at > time.time()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = None if ttl is None else time.time() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.get_max_size():
+                self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def stats(self):
+        return {"size": len(self), "max_size": self.get_max_size(), "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate()}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self.hits = 0
+        self.misses = 0
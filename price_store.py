@@ -0,0 +1,279 @@
+import os
+import glob
+import json
+import time
+import logging
+import numbers
+import threading
+import numpy as np
+import pandas as pd
+from utils import read_data, file_lock, atomic_write
+
+# One record per day, sorted by day (days since epoch)
+PRICE_DTYPE = np.dtype([("day", "<i8"), ("close", "<f8")])
+PRICE_STORE_DIR = os.path.join("./data", "prices")
+# Lookup policies: last close on or before the date, or closest close
+ASOF, NEAREST = "asof", "nearest"
+
+
+def to_days(dates):
+    dates = pd.DatetimeIndex(dates)
+    return dates.values.astype("datetime64[D]").astype(np.int64)
+
+
+def to_day(date):
+    return int(to_days([date])[0])
+
+
+def to_dates(days):
+    return pd.DatetimeIndex(np.asarray(days).astype("datetime64[D]")).astype("datetime64[ns]")
+
+
+class DayIndex():
+    """Sorted day numbers of a price series, resolving many dates at once"""
+
+    def __init__(self, days):
+        self.days = np.asarray(days, dtype=np.int64)
+
+    def locate(self, dates, policy=NEAREST, max_staleness=None):
+        """Positions of the closes used for `dates`, -1 where there is none.
+
+        ASOF takes the last close on or before each date, NEAREST the closest
+        one (the earlier one on ties). Closes more than `max_staleness` days
+        away from their date are not used.
+        """
+        wanted = to_days(dates)
+        n_days = len(self.days)
+        if n_days == 0:
+            return np.full(len(wanted), -1, dtype=np.int64)
+        after = np.searchsorted(self.days, wanted, side="right")
+        before = after - 1
+        if policy == ASOF:
+            positions = before
+        elif policy == NEAREST:
+            next_positions = np.minimum(after, n_days - 1)
+            no_day = np.iinfo(np.int64).max
+            before_gap = np.where(
+                before >= 0, wanted - self.days[np.maximum(before, 0)], no_day)
+            after_gap = np.where(
+                after < n_days, self.days[next_positions] - wanted, no_day)
+            positions = np.where(after_gap < before_gap, next_positions, before)
+        else:
+            raise ValueError(f"Unknown lookup policy {policy}")
+        if max_staleness is not None:
+            gaps = np.abs(self.days[np.maximum(positions, 0)] - wanted)
+            positions = np.where(
+                (positions >= 0) & (gaps <= max_staleness), positions, -1)
+        return positions
+
+
+class PriceStore():
+    """Columnar store of daily close prices, one memory-mapped file per pair.
+
+    Each `{from}_{to}.bin` file is a flat array of PRICE_DTYPE records sorted
+    by day, so lookups and range reads only touch the pages they need and new
+    closes are appended at the end of the file. Days known to have no close
+    are listed in `{from}_{to}.missing`. Latest quotes are kept in a small
+    `latest.json` next to them.
+    """
+
+    def __init__(self, root=PRICE_STORE_DIR):
+        self.root = root
+        self.latest_path = os.path.join(root, "latest.json")
+        self.lock = threading.Lock()
+
+    def get_path(self, from_currency, to_currency):
+        return os.path.join(self.root, f"{from_currency}_{to_currency}.bin")
+
+    def load(self, from_currency, to_currency):
+        path = self.get_path(from_currency, to_currency)
+        # A record torn by an interrupted append is ignored
+        n_records = os.path.getsize(path) // PRICE_DTYPE.itemsize \
+            if os.path.exists(path) else 0
+        if n_records == 0:
+            return np.empty(0, dtype=PRICE_DTYPE)
+        return np.memmap(path, dtype=PRICE_DTYPE, mode="r", shape=(n_records,))
+
+    def read(self, from_currency, to_currency, start=None, end=None):
+        records = self.load(from_currency, to_currency)
+        days = records["day"]
+        start_idx = 0 if start is None else np.searchsorted(
+            days, to_day(start), side="left")
+        end_idx = len(days) if end is None else np.searchsorted(
+            days, to_day(end), side="right")
+        records = np.array(records[start_idx:end_idx])
+        return pd.Series(records["close"], index=to_dates(records["day"]), name="close")
+
+    def lookup(self, from_currency, to_currency, date):
+        """Close stored for the day of `date`, None if there is none"""
+        close = self.lookup_many(from_currency, to_currency, [date], max_staleness=0)[0]
+        return None if np.isnan(close) else float(close)
+
+    def lookup_many(self, from_currency, to_currency, dates, policy=NEAREST, max_staleness=None):
+        """Closes for every date of `dates` (see DayIndex.locate), NaN where there is none"""
+        records = self.load(from_currency, to_currency)
+        positions = DayIndex(records["day"]).locate(
+            dates, policy=policy, max_staleness=max_staleness)
+        closes = np.full(len(positions), np.nan)
+        found = positions >= 0
+        closes[found] = records["close"][positions[found]]
+        return closes
+
+    def covers(self, from_currency, to_currency, dates):
+        """True if every date of `dates` has a close or is known to have none"""
+        days = self.load(from_currency, to_currency)["day"]
+        missing = self.read_missing(from_currency, to_currency)
+        if len(missing):
+            days = np.union1d(days, missing)
+        if len(days) == 0:
+            return False
+        wanted = to_days(dates)
+        idx = np.minimum(np.searchsorted(days, wanted), len(days) - 1)
+        return bool(np.all(days[idx] == wanted))
+
+    def get_missing_path(self, from_currency, to_currency):
+        return os.path.join(self.root, f"{from_currency}_{to_currency}.missing")
+
+    def read_missing(self, from_currency, to_currency):
+        """Sorted days known to have no close, see mark_missing"""
+        path = self.get_missing_path(from_currency, to_currency)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int64)
+        days = np.fromfile(path, dtype="<i8")
+        return np.unique(days[:os.path.getsize(path) // 8])
+
+    def mark_missing(self, from_currency, to_currency, dates):
+        """Remember that the days of `dates` have no close, so they are not queried again"""
+        days = np.setdiff1d(to_days(dates), self.read_missing(from_currency, to_currency))
+        if len(days) == 0:
+            return
+        path = self.get_missing_path(from_currency, to_currency)
+        with self.lock, file_lock(path):
+            with open(path, "ab") as f:
+                torn = f.tell() % 8
+                if torn:
+                    f.truncate(f.tell() - torn)
+                f.write(days.astype("<i8").tobytes())
+
+    def append(self, from_currency, to_currency, series):
+        # The file lock serializes the processes sharing the store
+        path = self.get_path(from_currency, to_currency)
+        with self.lock, file_lock(path):
+            self._append(from_currency, to_currency, series)
+
+    def _append(self, from_currency, to_currency, series):
+        series = series.dropna()
+        new = np.empty(len(series), dtype=PRICE_DTYPE)
+        new["day"] = to_days(series.index)
+        new["close"] = series.values
+        new = self._deduplicate(new)
+        if len(new) == 0:
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self.get_path(from_currency, to_currency)
+        existing = self.load(from_currency, to_currency)
+        if len(existing):
+            last_day = existing["day"][-1]
+            overlap = new[new["day"] <= last_day]
+            idx = np.minimum(np.searchsorted(
+                existing["day"], overlap["day"]), len(existing) - 1)
+            unchanged = np.all(existing["day"][idx] == overlap["day"]) and \
+                np.allclose(existing["close"][idx], overlap["close"])
+            if not unchanged:
+                # Out of order or updated closes: merge and rewrite the pair
+                merged = self._deduplicate(
+                    np.concatenate([np.array(existing), new]))
+                del existing
+                atomic_write(path, merged.tobytes())
+                return
+            new = new[new["day"] > last_day]
+
+        with open(path, "ab") as f:
+            torn = f.tell() % PRICE_DTYPE.itemsize
+            if torn:
+                f.truncate(f.tell() - torn)
+            f.write(new.tobytes())
+
+    @staticmethod
+    def _deduplicate(records):
+        # Sort by day and keep the last record of each day
+        records = records[np.argsort(records["day"], kind="stable")]
+        keep = np.append(records["day"][1:] != records["day"][:-1], True)
+        return records[keep]
+
+    def _read_latest(self):
+        if not os.path.exists(self.latest_path):
+            return {}
+        try:
+            with open(self.latest_path, "r") as f:
+                return json.load(f)
+        except ValueError as e:
+            logging.warning(f"Ignoring corrupt {self.latest_path}: {e}")
+            return {}
+
+    def get_latest(self, from_currency, to_currency, expiration=3600):
+        """Return (price, ts) of the latest quote if younger than `expiration`"""
+        entry = self._read_latest().get(f"{from_currency}_{to_currency}")
+        if (entry is None) or ((time.time() - entry["ts"]) > expiration):
+            return None
+        return entry["value"], entry["ts"]
+
+    def set_latest(self, from_currency, to_currency, price, ts=None):
+        self.set_latest_many({(from_currency, to_currency): price}, ts=ts)
+
+    def set_latest_many(self, prices, ts=None):
+        """Store the latest quotes {(from, to): price} with a single rewrite of latest.json"""
+        if not prices:
+            return
+        ts = time.time() if ts is None else ts
+        with self.lock, file_lock(self.latest_path):
+            latest = self._read_latest()
+            for (from_currency, to_currency), price in prices.items():
+                latest[f"{from_currency}_{to_currency}"] = {"value": float(price), "ts": ts}
+            atomic_write(self.latest_path, json.dumps(latest).encode())
+
+
+def read_legacy_prices(cached):
+    """Closes of a legacy price pickle as a series by day, None if it holds none"""
+    price_data = cached.get("value") if isinstance(cached, dict) else None
+    if not isinstance(price_data, pd.DataFrame):
+        return None
+    column = "close" if "close" in price_data.columns else "price"
+    if column not in price_data.columns:
+        return None
+    try:
+        index = pd.DatetimeIndex(price_data.index).normalize()
+    except (ValueError, TypeError):
+        return None
+    return pd.Series(price_data[column].values.astype(float), index=index)
+
+
+def migrate_pickles(store, data_dir="./data"):
+    """One-shot import of the legacy `{from}_{to}[_latest].pkl` price files"""
+    for path in sorted(glob.glob(os.path.join(data_dir, "*_*.pkl"))):
+        file_name = os.path.basename(path)
+        if file_name.startswith(("cached_portfolio", "cached_ledger")):
+            continue
+        cached = read_data(path)
+        if cached is None:
+            continue
+        if file_name.endswith("_latest.pkl"):
+            price = cached.get("value") if isinstance(cached, dict) else None
+            if not isinstance(price, numbers.Real):
+                logging.info(f"Skipping {path}, not a legacy price file")
+                continue
+            from_currency, to_currency = file_name[:-len("_latest.pkl")].split("_", 1)
+            store.set_latest(from_currency, to_currency, price, ts=cached["ts"])
+        else:
+            closes = read_legacy_prices(cached)
+            if closes is None:
+                logging.info(f"Skipping {path}, not a legacy price file")
+                continue
+            from_currency, to_currency = file_name[:-len(".pkl")].split("_", 1)
+            store.append(from_currency, to_currency, closes)
+        logging.info(f"Migrated {path} to the price store")
+
+
+if __name__ == "__main__":
+    migrate_pickles(PriceStore())
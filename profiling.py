@@ -0,0 +1,99 @@
+import json
+import time
+import threading
+from functools import wraps
+
+# Stages whose name starts with this prefix are remote API calls
+NETWORK_PREFIX = "network."
+
+
+class StageTimer():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler():
+    """Call counts and cumulative wall time of the instrumented stages.
+
+    Like the tracer it is a no-op unless enabled: a profiled function only
+    checks `PROFILER.enabled` before calling through. Nested stages are all
+    timed, so the wall times of a stage include the stages it calls.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.stats = {}
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add(self, name, elapsed):
+        with self.lock:
+            stat = self.stats.setdefault(name, [0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+
+    def timer(self, name):
+        """Context manager timing the enclosed block under `name`"""
+        return StageTimer(self, name)
+
+    def stage(self, name):
+        """Decorator timing every call of the decorated function under `name`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def report(self):
+        from currencies import PRICE_CACHE
+        stages = {name: {"calls": calls, "seconds": seconds}
+                  for name, (calls, seconds) in sorted(self.stats.items(),
+                                                       key=lambda item: -item[1][1])}
+        return {"stages": stages,
+                "network_calls": sum(stage["calls"] for name, stage in stages.items()
+                                     if name.startswith(NETWORK_PREFIX)),
+                "price_cache": PRICE_CACHE.stats()}
+
+    def format_report(self):
+        report = self.report()
+        lines = [f"{'stage':<40}{'calls':>10}{'total (s)':>12}{'mean (ms)':>12}"]
+        for name, stage in report["stages"].items():
+            lines.append(f"{name:<40}{stage['calls']:>10}{stage['seconds']:>12.4f}"
+                         f"{1000 * stage['seconds'] / stage['calls']:>12.3f}")
+        lines.append(f"Network calls: {report['network_calls']}")
+        lines.append(f"Price cache hit rate: {report['price_cache']['hit_rate']:.2%} "
+                     f"({report['price_cache']['hits']} hits, {report['price_cache']['misses']} misses)")
+        return "\n".join(lines)
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+PROFILER = Profiler()
+profiled = PROFILER.stage
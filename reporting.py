@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from history import valuation, safe_divide, TOTAL_COLUMN
+from profiling import profiled
+
+# Columns of the metrics table expressed in a currency, the others are rates
+MONETARY_COLUMNS = ["current_value", "invested", "invested_up_now", "unrealized_return"]
+RATE_COLUMNS = ["return_rate", "all_return_rate"]
+
+
+@profiled("metrics_table")
+def metrics_table(portfolio):
+    """Metrics of every security and of the portfolio, in the base currency.
+
+    Rows are the security tickers followed by TOTAL_COLUMN. Each security is
+    converted to the base currency once, whatever the number of currencies
+    the table is later projected to.
+    """
+    securities = list(portfolio.securities.values())
+    values = np.array([security.value for security in securities], dtype=float)
+    invested = np.array([security.total_invested for security in securities], dtype=float)
+    invested_up_now = np.array([security.total_invested_up_now for security in securities],
+                               dtype=float)
+    realized_profit = np.array([security.realized_profit for security in securities], dtype=float)
+    prices = np.array([security.get_current_unit_value() for security in securities], dtype=float)
+    current_value, unrealized_return, return_rate = valuation(values, invested, prices)
+    metrics = pd.DataFrame({
+        "current_value": current_value,
+        "invested": invested,
+        "invested_up_now": invested_up_now,
+        "unrealized_return": unrealized_return,
+        "return_rate": return_rate,
+        "all_return_rate": safe_divide(realized_profit + unrealized_return, invested_up_now),
+    }, index=pd.Index([security.ticker for security in securities], dtype=object))
+
+    total_value = current_value.sum()
+    total_return = total_value - portfolio._total_invested
+    metrics.loc[TOTAL_COLUMN] = {
+        "current_value": total_value,
+        "invested": portfolio._total_invested,
+        "invested_up_now": portfolio.total_invested_up_now,
+        "unrealized_return": total_return,
+        "return_rate": float(safe_divide(total_return, total_value)),
+        "all_return_rate": float(safe_divide(portfolio.realized_profit + total_return,
+                                             portfolio.total_invested_up_now)),
+    }
+    return metrics
+
+
+def project_metrics(metrics, base_currency_unit, currency_units):
+    """Metrics table of each currency of `currency_units`, keyed by currency name.
+
+    Monetary columns are multiplied by the latest rate from the base currency,
+    one multiplication per currency; rates are unchanged.
+    """
+    projected = {}
+    for currency_unit in currency_units:
+        rate = base_currency_unit.convert(currency_unit, 1)
+        table = metrics.copy()
+        table[MONETARY_COLUMNS] = metrics[MONETARY_COLUMNS].values * rate
+        projected[currency_unit.name] = table
+    return projected
+
+
+def format_metrics(metrics, currency_name, tabulation="", tabulation_char="\t"):
+    """Same layout as Portfolio.display, from a projected metrics table"""
+    def format_row(row, tabulation):
+        row_str = f"{tabulation}Current value: {row.current_value} {currency_name}\n"
+        row_str += f"{tabulation}Invested: {row.invested} {currency_name}\n"
+        row_str += f"{tabulation}Invested all to now: {row.invested_up_now} {currency_name}\n"
+        row_str += f"{tabulation}Unrealized Return: {row.unrealized_return} {currency_name}\n"
+        row_str += f"{tabulation}Return rate: {row.return_rate*100} %\n"
+        return row_str
+
+    total = metrics.loc[TOTAL_COLUMN]
+    report = format_row(total, tabulation)
+    report += f"{tabulation}All Return rate: {total.all_return_rate*100} %\n"
+    new_tab = tabulation + tabulation_char
+    for ticker, row in metrics.drop(TOTAL_COLUMN).iterrows():
+        report += f"{new_tab}{ticker}:\n" + format_row(row, new_tab + tabulation_char)
+    return report
@@ -0,0 +1,121 @@
+import os
+import logging
+import threading
+from collections import defaultdict, deque, namedtuple
+import pandas as pd
+from utils import get_asset_pairs, get_fiat_currencies, get_crypto_alt_names, get_cached
+from utils import read_json, save_data, PROXY_CURRENCIES, ASSET_PAIRS_FILE
+
+ASSET_PAIRS_FIXTURE = "./data/asset_pairs.json"
+ROUTES_FILE = "routes.pkl"
+KRAKEN, FIAT = "kraken", "fiat"
+
+# One conversion step: a Kraken pair (inverted when converting quote to base)
+# or a fiat exchange rate
+Leg = namedtuple("Leg", ["source", "pair", "from_currency", "to_currency", "invert"])
+
+_route_planner = None
+_route_planner_lock = threading.Lock()
+_routes_lock = threading.Lock()
+
+
+def normalize_asset(name):
+    """Common name of an asset in Kraken pairs, ledgers and rate tables.
+
+    Legacy Kraken assets carry an X (crypto) or Z (fiat) prefix: XXBT, ZEUR.
+    """
+    name = get_crypto_alt_names().get(name, name)
+    if len(name) == 4 and name[0] in "XZ":
+        return name[1:]
+    return name
+
+
+def load_asset_pairs(client):
+    """Kraken AssetPairs, the last fetched ones (however old) when Kraken is unreachable.
+
+    A local fixture is read when they were never fetched.
+    """
+    try:
+        return get_asset_pairs(client)
+    except Exception as e:
+        stale = get_cached(ASSET_PAIRS_FILE, expiration=float("inf"))
+        if stale is not None:
+            logging.warning(f"AssetPairs query failed, using the pairs fetched at "
+                            f"{pd.to_datetime(stale['ts'], unit='s')}: {e}")
+            return stale["value"]
+        if not os.path.exists(ASSET_PAIRS_FIXTURE):
+            raise
+        logging.debug(f"Using {ASSET_PAIRS_FIXTURE}, AssetPairs query failed: {e}")
+        return pd.DataFrame(read_json(ASSET_PAIRS_FIXTURE)).T
+
+
+class RoutePlanner():
+    """Shortest conversion routes over Kraken pairs and fiat exchange rates"""
+
+    def __init__(self, asset_pairs, fiat_currencies):
+        self.graph = defaultdict(list)
+        for pair, info in asset_pairs.iterrows():
+            # Dark pool pairs duplicate the regular ones
+            if pair.endswith(".d"):
+                continue
+            base, quote = normalize_asset(info["base"]), normalize_asset(info["quote"])
+            self.graph[base].append(Leg(KRAKEN, pair, base, quote, False))
+            self.graph[quote].append(Leg(KRAKEN, pair, quote, base, True))
+        # Proxy currencies are explored first, as Kraken quotes most assets in them
+        self.fiat_currencies = PROXY_CURRENCIES + \
+            [name for name in fiat_currencies if name not in PROXY_CURRENCIES]
+        for node, legs in self.graph.items():
+            legs.sort(key=lambda leg: leg.to_currency not in PROXY_CURRENCIES)
+        self.routes = {}
+
+    def get_legs(self, currency):
+        yield from self.graph.get(currency, [])
+        if currency in self.fiat_currencies:
+            for other in self.fiat_currencies:
+                if other != currency:
+                    yield Leg(FIAT, None, currency, other, False)
+
+    def find_route(self, from_currency, to_currency):
+        """Breadth first search of the route with the fewest legs"""
+        if from_currency == to_currency:
+            return []
+        previous = {from_currency: None}
+        queue = deque([from_currency])
+        while queue:
+            currency = queue.popleft()
+            for leg in self.get_legs(currency):
+                if leg.to_currency in previous:
+                    continue
+                previous[leg.to_currency] = leg
+                if leg.to_currency == to_currency:
+                    route = []
+                    while leg is not None:
+                        route.append(leg)
+                        leg = previous[leg.from_currency]
+                    return route[::-1]
+                queue.append(leg.to_currency)
+        return None
+
+    def route(self, from_currency, to_currency):
+        """Legs converting `from_currency` to `to_currency`, None if impossible"""
+        key = (from_currency, to_currency)
+        with _routes_lock:
+            if key not in self.routes:
+                self.routes[key] = self.find_route(
+                    normalize_asset(from_currency), normalize_asset(to_currency))
+                save_data(self, ROUTES_FILE)
+            return self.routes[key]
+
+
+def get_route_planner(client, expiration=86400):
+    """Route planner shared by the process, persisted in ROUTES_FILE"""
+    global _route_planner
+    with _route_planner_lock:
+        if _route_planner is None:
+            cached = get_cached(ROUTES_FILE, expiration=expiration)
+            if cached is not None:
+                _route_planner = cached["value"]
+            else:
+                _route_planner = RoutePlanner(
+                    load_asset_pairs(client), get_fiat_currencies())
+        return _route_planner
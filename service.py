@@ -0,0 +1,211 @@
+import json
+import time
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from config import get_config, get_client
+from currencies import CurrencyUnit, fetch_latest_prices
+from portfolio import Portfolio
+from ledger_store import LedgerStore
+from reporting import project_metrics
+from history import compute_history, HISTORY_FUNCS, TOTAL_COLUMN
+from tracing import TRACER
+from utils import str2date
+
+QUERY_PATHS = ["/health", "/value", "/returns", "/metrics", "/history"]
+
+
+class PortfolioService():
+    """Portfolio kept in memory and refreshed on a schedule, queried over HTTP.
+
+    Latest prices are refreshed every `price_refresh` seconds, along with the
+    rates of the other currencies queried so far, and new ledger entries
+    synced every `ledger_sync` seconds. Responses are built once per refresh
+    and served from memory until the next one.
+    """
+
+    def __init__(self, base_currency_ticker, price_refresh=60, ledger_sync=300):
+        self.base_currency_ticker = base_currency_ticker
+        self.price_refresh = price_refresh
+        self.ledger_sync = ledger_sync
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.server = None
+        self.responses = {}
+        # Currencies the responses were projected to, refreshed with the prices
+        self.currencies = set()
+        self.updated = None
+        self.ledger_store = LedgerStore()
+        self.portfolio = Portfolio.from_kraken_ledger(base_currency_ticker)
+        self.refresh_prices()
+
+    @classmethod
+    def from_config(clf, base_currency_ticker):
+        config = get_config()
+        service_config = config["Service"] if config.has_section("Service") else {}
+        return clf(base_currency_ticker,
+                   price_refresh=float(service_config.get("price_refresh", 60)),
+                   ledger_sync=float(service_config.get("ledger_sync", 300)))
+
+    def invalidate(self):
+        # Called with the lock held, after any change of the portfolio or its prices
+        self.portfolio.invalidate()
+        for security in self.portfolio.securities.values():
+            security.invalidate()
+        self.responses = {}
+        self.updated = time.time()
+
+    def refresh_prices(self):
+        with self.lock:
+            self.portfolio.fetch_latest_prices(refresh=True)
+            for currency in self.currencies:
+                try:
+                    fetch_latest_prices([self.base_currency_ticker], currency, refresh=True)
+                except Exception as e:
+                    logging.warning(f"Refresh of the {currency} rate failed: {e}")
+            self.invalidate()
+
+    def sync_ledger(self):
+        with self.lock:
+            self.ledger_store.sync(get_client())
+            trades_history = self.ledger_store.entries_after(self.portfolio.last_ledger_id)
+            if trades_history is None:
+                logging.info("Portfolio does not match the ledger store, rebuilding it")
+                self.portfolio = Portfolio.from_kraken_ledger(self.base_currency_ticker)
+            elif not trades_history.empty:
+                logging.info(f"Replaying {len(trades_history)} new ledger entries")
+                self.portfolio.update_from_ledger(trades_history)
+            else:
+                return
+            self.invalidate()
+
+    def run_every(self, interval, task):
+        while not self.stopped.wait(interval):
+            try:
+                task()
+            except Exception as e:
+                logging.warning(f"{task.__name__} failed: {e}")
+
+    def get_metrics(self, currency):
+        if currency == self.base_currency_ticker:
+            return self.portfolio.get_metrics()
+        return project_metrics(self.portfolio.get_metrics(), self.portfolio.base_currency_unit,
+                               [CurrencyUnit.create_currency_unit(currency)])[currency]
+
+    def query(self, path, params):
+        """JSON body answering a GET of one of QUERY_PATHS"""
+        currency = params.get("currency", self.base_currency_ticker)
+        if path == "/health":
+            return json.dumps({"updated": self.updated,
+                               "last_ledger_id": self.portfolio.last_ledger_id})
+        if path == "/value":
+            total = self.get_metrics(currency).loc[TOTAL_COLUMN]
+            return json.dumps({"currency": currency, "updated": self.updated,
+                               "value": float(total["current_value"])})
+        if path == "/returns":
+            total = self.get_metrics(currency).loc[TOTAL_COLUMN]
+            return json.dumps({"currency": currency, "updated": self.updated,
+                               **{name: float(value) for name, value in total.items()}})
+        if path == "/metrics":
+            return self.get_metrics(currency).to_json(orient="index", double_precision=15)
+        if path == "/history":
+            func_name = params.get("func", "get_return_rate")
+            if func_name not in HISTORY_FUNCS:
+                raise ValueError(f"func must be one of {HISTORY_FUNCS}")
+            start_date = max(str2date(params.get("start", "2021-04-01")),
+                             pd.to_datetime(self.portfolio.first_transaction_time).normalize())
+            history = compute_history(self.portfolio, start_date, str2date(params.get("end")),
+                                      currency_unit=CurrencyUnit.create_currency_unit(currency))
+            return history[func_name].to_json(orient="split", date_format="iso",
+                                              double_precision=15)
+
+    def respond(self, url):
+        """(status, body) of a GET of `url`, bodies are kept until the next refresh"""
+        url = urlparse(url)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        key = (url.path, tuple(sorted(params.items())))
+        body = self.responses.get(key)
+        if body is not None:
+            return 200, body
+        if url.path not in QUERY_PATHS:
+            return 404, json.dumps({"error": f"Unknown path {url.path}"}).encode()
+        with self.lock:
+            try:
+                body = self.query(url.path, params).encode()
+            except Exception as e:
+                logging.debug(f"Query {url.geturl()} failed: {e}")
+                return 400, json.dumps({"error": str(e)}).encode()
+            self.responses[key] = body
+            if params.get("currency", self.base_currency_ticker) != self.base_currency_ticker:
+                self.currencies.add(params["currency"])
+        return 200, body
+
+    def start(self, host="127.0.0.1", port=8765):
+        """Serve in background threads, port 0 picks a free port (see `address`)"""
+        self.server = ThreadingHTTPServer((host, port), PortfolioRequestHandler)
+        self.server.service = self
+        self.stopped.clear()
+        self.threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True),
+            threading.Thread(target=self.run_every, args=(self.price_refresh, self.refresh_prices),
+                             daemon=True),
+            threading.Thread(target=self.run_every, args=(self.ledger_sync, self.sync_ledger),
+                             daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"Serving the {self.base_currency_ticker} portfolio on {self.address}")
+
+    @property
+    def address(self):
+        return self.server.server_address if self.server is not None else None
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class PortfolioRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, body = self.server.service.respond(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Serves the portfolio over a local HTTP/JSON API")
+    parser.add_argument("--currency", type=str, default="CHF")
+    parser.add_argument("--host", type=str, default=None)
+    parser.add_argument("--port", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = get_config()
+    logging.basicConfig(filename="service_log.log",
+                        level=config["Global"].get("log_level", "INFO"))
+    TRACER.configure_from(config)
+    service_config = config["Service"] if config.has_section("Service") else {}
+    service = PortfolioService.from_config(config["Portfolio"].get("currency", args.currency))
+    service.start(host=args.host or service_config.get("host", "127.0.0.1"),
+                  port=args.port if args.port is not None else int(service_config.get("port", 8765)))
+    try:
+        service.stopped.wait()
+    except KeyboardInterrupt:
+        service.stop()
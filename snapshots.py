@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_FIELDS = ["value", "total_invested",
+                   "total_invested_up_now", "realized_profit"]
+# Portfolio level totals are stored next to the securities under this key
+PORTFOLIO_KEY = "__portfolio__"
+
+
+class SnapshotStore():
+    """Append-only log of per-security state deltas keyed by timestamp.
+
+    The state of every security (and of the portfolio totals) at any date is
+    rebuilt by summing the deltas recorded up to that date.
+    """
+
+    def __init__(self, capacity=64):
+        self.keys = []
+        self.key_index = {}
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.key_ids = np.empty(capacity, dtype=np.int32)
+        self.deltas = np.empty(
+            (capacity, len(SNAPSHOT_FIELDS)), dtype=np.float64)
+        self.size = 0
+        self.last_state = {}
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = 2 * len(self.timestamps)
+        for attr in ["timestamps", "key_ids", "deltas"]:
+            old = getattr(self, attr)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, attr, new)
+
+    def _get_key_id(self, key):
+        if key not in self.key_index:
+            self.key_index[key] = len(self.keys)
+            self.keys.append(key)
+        return self.key_index[key]
+
+    def append(self, timestamp, key, state):
+        state = np.asarray(state, dtype=np.float64)
+        previous = self.last_state.get(key)
+        if previous is None:
+            delta = state
+        else:
+            delta = state - previous
+            if not delta.any():
+                return
+        if self.size and timestamp < self.timestamps[self.size - 1]:
+            raise ValueError(
+                "Snapshots must be recorded in chronological order")
+        if self.size == len(self.timestamps):
+            self._grow()
+
+        self.timestamps[self.size] = timestamp
+        self.key_ids[self.size] = self._get_key_id(key)
+        self.deltas[self.size] = delta
+        self.size += 1
+        self.last_state[key] = state
+
+    def record(self, timestamp, portfolio, keys=None):
+        timestamp = pd.Timestamp(timestamp).value
+        if keys is None:
+            keys = list(portfolio.securities.keys())
+        for key in keys:
+            security = portfolio.securities[key]
+            self.append(timestamp, key,
+                        [getattr(security, field) for field in SNAPSHOT_FIELDS])
+        self.append(timestamp, PORTFOLIO_KEY,
+                    [0, portfolio._total_invested, portfolio.total_invested_up_now,
+                     portfolio.realized_profit])
+
+    def count_until(self, date):
+        """Number of entries recorded on or before the day of `date`"""
+        end = (pd.Timestamp(date).normalize() + pd.Timedelta(days=1)).value
+        return int(np.searchsorted(self.timestamps[:self.size], end, side="left"))
+
+    def state_from_count(self, count):
+        state = np.zeros((len(self.keys), len(SNAPSHOT_FIELDS)))
+        np.add.at(state, self.key_ids[:count], self.deltas[:count])
+        seen = np.zeros(len(self.keys), dtype=bool)
+        seen[self.key_ids[:count]] = True
+        return {key: state[i] for i, key in enumerate(self.keys) if seen[i]}
+
+    def state_at(self, date):
+        """Return {key: array of SNAPSHOT_FIELDS} as of the end of `date`"""
+        return self.state_from_count(self.count_until(date))
+
+    def states_at(self, dates):
+        """Return (keys, array of shape (len(dates), len(keys), len(SNAPSHOT_FIELDS)))
+
+        Keys that were not recorded yet at a date hold NaN.
+        """
+        dates = pd.DatetimeIndex(dates).normalize()
+        ends = (dates + pd.Timedelta(days=1)).asi8
+        counts = np.searchsorted(self.timestamps[:self.size], ends, side="left")
+
+        n_fields = len(SNAPSHOT_FIELDS)
+        key_ids = self.key_ids[:self.size]
+        states = np.full((len(dates), len(self.keys), n_fields), np.nan)
+        for key_id in range(len(self.keys)):
+            rows = np.flatnonzero(key_ids == key_id)
+            cumulative = np.cumsum(self.deltas[rows], axis=0)
+            # Number of entries of this key recorded before each date end
+            n_rows = np.searchsorted(rows, counts, side="left")
+            seen = n_rows > 0
+            states[seen, key_id] = cumulative[n_rows[seen] - 1]
+        return list(self.keys), states
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# The modules of the package live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import benchmark
+
+
+@pytest.fixture
+def bench():
+    """Synthetic 300 transaction account in a scratch directory, against the offline fakes"""
+    bench = benchmark.Benchmark(300, base_currency="EUR", days=700)
+    yield bench
+    bench.close()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from benchmark import FakeKrakenClient, MarketModel
+from backfill import backfill_closes, get_window_start
+from price_store import PriceStore, to_days
+
+
+class GapClient(FakeKrakenClient):
+    """Fake client without any trade on the days of `gap`"""
+
+    def __init__(self, market, gap):
+        super().__init__(market)
+        self.gap = gap
+
+    def get_recent_trades(self, pair, since=None, ascending=False):
+        trades, last = super().get_recent_trades(pair, since=since, ascending=ascending)
+        return trades[~pd.DatetimeIndex(trades.index).normalize().isin(self.gap)], last
+
+
+def test_backfill_walks_the_trades_once(tmp_path):
+    market = MarketModel(["XXBT"], days=1100)
+    old_dates = market.dates[market.dates < get_window_start()][-200:]
+    gap = old_dates[50:53]
+    client = GapClient(market, gap)
+    store = PriceStore(str(tmp_path))
+
+    stored = backfill_closes(store, client, "XXBTZEUR", "XXBT", "EUR", old_dates)
+    # One page of the fake covers about a week of trades
+    assert client.calls["get_recent_trades"] < len(old_dates) / 5
+    found = old_dates[~old_dates.isin(gap)]
+    expected = [market.get_rate("XXBT", "EUR", market.get_day(date)) for date in found]
+    assert np.allclose(stored[found].values, expected)
+    # A day without trades takes the first trade of the next day
+    assert stored[gap[-1]] == market.get_rate("XXBT", "EUR", market.get_day(gap[-1]) + 1)
+    assert list(store.read_missing("XXBT", "EUR")) == list(to_days(gap[:-1]))
+
+    calls = client.calls["get_recent_trades"]
+    backfill_closes(store, client, "XXBTZEUR", "XXBT", "EUR", old_dates)
+    assert client.calls["get_recent_trades"] == calls
+    assert store.covers("XXBT", "EUR", old_dates)
@@ -0,0 +1,25 @@
+import os
+import benchmark
+import config
+import routes
+from config import get_config
+from currencies import PRICE_CACHE
+
+
+def test_close_restores_the_replaced_globals(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    previous = {name: getattr(config, name) for name in benchmark.GLOBALS}
+    previous_route_planner = routes._route_planner
+    bench = benchmark.Benchmark(20, days=100)
+    try:
+        get_config()["Global"]["cost_basis"] = "fifo"
+        assert config.get_client() is bench.client
+        from portfolio import Portfolio
+        Portfolio.from_kraken_ledger("EUR")
+        assert routes._route_planner is not previous_route_planner
+    finally:
+        bench.close()
+    assert os.getcwd() == str(tmp_path)
+    assert {name: getattr(config, name) for name in benchmark.GLOBALS} == previous
+    assert routes._route_planner is previous_route_planner
+    assert len(PRICE_CACHE) == 0
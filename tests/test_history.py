@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+from currencies import CurrencyUnit
+from history import compute_history, TOTAL_COLUMN
+
+
+def test_prices_only_requested_while_held(bench, monkeypatch):
+    from portfolio import Portfolio
+    portfolio = Portfolio.from_kraken_ledger("EUR")
+    requested = {}
+    get_price_series = CurrencyUnit.get_price_series
+
+    def spy(self, to, dates):
+        requested.setdefault(self.name, []).extend(dates)
+        return get_price_series(self, to, dates)
+    monkeypatch.setattr(CurrencyUnit, "get_price_series", spy)
+
+    start = bench.ledger.index[0].normalize()
+    end = pd.Timestamp.now().normalize() - pd.Timedelta(days=1)
+    history = compute_history(portfolio, start, end)["get_current_value"]
+    ledger = bench.ledger
+    assert requested
+    for asset, dates in requested.items():
+        assert min(dates) >= ledger.index[ledger.asset == asset].min().normalize()
+    # Not held yet is NaN, sold out is 0
+    for asset in history.columns.drop([TOTAL_COLUMN, "EUR"]):
+        first = ledger.index[ledger.asset == asset].min().normalize()
+        assert history.loc[history.index < first, asset].isna().all()
+        assert not history.loc[history.index >= first, asset].isna().any()
+    assert not np.isnan(history[TOTAL_COLUMN].values).any()
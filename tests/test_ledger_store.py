@@ -0,0 +1,129 @@
+import os
+import pandas as pd
+import pytest
+import ledger_store
+from benchmark import FakeKrakenClient, MarketModel, synthetic_ledger, BENCHMARK_CRYPTOS
+from ledger_store import LedgerStore, ChunkedLedgerStore, iter_ledger_pages
+from utils import save_data
+
+
+def ids(entries):
+    # Legs of a trade share their timestamp and may come back in any order
+    return sorted(set(entries.ledger_id))
+
+
+def assert_no_duplicates(entries):
+    assert not entries.ledger_id.duplicated().any()
+
+
+@pytest.fixture
+def ledger():
+    return synthetic_ledger(150)
+
+
+@pytest.fixture
+def client(ledger):
+    return FakeKrakenClient(MarketModel(BENCHMARK_CRYPTOS[:8], days=10), ledger.iloc[:200], page_size=50)
+
+
+@pytest.fixture(autouse=True)
+def data_dir(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+
+
+class GrowingClient(FakeKrakenClient):
+    """Fake client whose ledger receives `arrivals` after the first call"""
+
+    def __init__(self, market, ledger, arrivals, page_size):
+        super().__init__(market, ledger, page_size=page_size)
+        self.arrivals = arrivals
+
+    def get_ledgers_info(self, **kwargs):
+        result = super().get_ledgers_info(**kwargs)
+        if self.arrivals is not None:
+            self.ledger, self.arrivals = pd.concat([self.ledger, self.arrivals]), None
+        return result
+
+
+def test_iter_ledger_pages_oldest_first(ledger, client):
+    pages = list(iter_ledger_pages(client))
+    assert all(len(page) <= client.page_size for page in pages)
+    entries = pd.concat(pages)
+    assert ids(entries) == ids(ledger.iloc[:200])
+    assert entries.index.is_monotonic_increasing
+    # Only entries sharing the timestamp of the cursor are returned twice
+    duplicated = entries[entries.ledger_id.duplicated()]
+    assert set(duplicated.index) <= {page.index[-1] for page in pages}
+    start = ledger.ledger_id.iloc[120]
+    assert ids(pd.concat(iter_ledger_pages(client, start=start))) == \
+        ids(ledger.iloc[121:200])
+
+
+def test_iter_ledger_pages_recomputes_the_offset_when_entries_arrive(ledger):
+    client = GrowingClient(MarketModel(BENCHMARK_CRYPTOS[:8], days=10), ledger.iloc[:130],
+                           ledger.iloc[130:170], page_size=50)
+    entries = pd.concat(iter_ledger_pages(client))
+    assert ids(entries) == ids(ledger.iloc[:170])
+
+
+def test_ledger_store_syncs_only_new_entries(ledger, client):
+    store = LedgerStore()
+    assert len(store.sync(client)) == 200
+    client.ledger = ledger.iloc[:260]
+    new_entries = LedgerStore().sync(client)
+    assert ids(new_entries) == ids(ledger.iloc[200:260])
+    assert_no_duplicates(new_entries)
+    store = LedgerStore()
+    assert ids(store.entries) == ids(ledger.iloc[:260])
+    assert_no_duplicates(store.entries)
+    assert store.last_id == store.entries.ledger_id.iloc[-1]
+    assert store.last_time == ledger.index[259]
+    cursor = store.entries.ledger_id.iloc[249]
+    assert list(store.entries_after(cursor).ledger_id) == list(store.entries.ledger_id.iloc[250:])
+    assert store.entries_after("unknown") is None
+
+
+def test_ledger_store_empty_sync_only_reads_the_cursor(ledger, client, monkeypatch):
+    LedgerStore().sync(client)
+    read_paths = []
+    read_data = ledger_store.read_data
+
+    def spy(path, **kwargs):
+        read_paths.append(path)
+        return read_data(path, **kwargs)
+    monkeypatch.setattr(ledger_store, "read_data", spy)
+    calls = client.calls["get_ledgers_info"]
+    store = LedgerStore()
+    assert store.sync(client).empty
+    assert store.entries_after(ledger.ledger_id.iloc[199]).empty
+    assert client.calls["get_ledgers_info"] == calls + 1
+    assert set(read_paths) == {"ledger_cursor.pkl"}
+
+
+def test_ledger_store_reads_the_cursor_of_a_ledger_saved_without_one(ledger, client):
+    entries = ledger.iloc[:100]
+    save_data({"entries": entries, "last_id": entries.ledger_id.iloc[-1],
+               "last_time": entries.index[-1]}, "ledger.pkl")
+    store = LedgerStore()
+    assert store.last_id == entries.ledger_id.iloc[-1]
+    assert os.path.exists(os.path.join("data", "ledger_cursor.pkl"))
+    new_entries = store.sync(client)
+    assert ids(new_entries) == ids(ledger.iloc[100:200])
+    assert_no_duplicates(pd.concat([entries, new_entries]))
+
+
+def test_chunked_ledger_store_sync(ledger, client):
+    store = ChunkedLedgerStore(chunk_size=30)
+    assert store.sync(client) == 200
+    client.ledger = ledger.iloc[:245]
+    assert ChunkedLedgerStore(chunk_size=30).sync(client) == 45
+    store = ChunkedLedgerStore(chunk_size=30)
+    chunks = list(store.iter_chunks())
+    assert all(len(chunk) == 30 for chunk in chunks[:-1])
+    entries = pd.concat(chunks)
+    assert ids(entries) == ids(ledger.iloc[:245])
+    assert_no_duplicates(entries)
+    index, position = store.locate(entries.ledger_id.iloc[99])
+    assert list(pd.concat(store.iter_chunks((index, position))).ledger_id) == \
+        list(entries.ledger_id.iloc[100:])
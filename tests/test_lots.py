@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from config import get_config
+from lots import LotBook, FIFO, LIFO, HIFO
+
+
+@pytest.mark.parametrize("method, gain, open_lots", [
+    (FIFO, 20.0, [(2, 0.5, 30.0), (3, 1, 20.0)]),
+    (LIFO, 10.0, [(2, 0.5, 30.0), (1, 1, 10.0)]),
+    (HIFO, 5.0, [(3, 0.5, 20.0), (1, 1, 10.0)]),
+])
+def test_lot_matching_order(method, gain, open_lots):
+    lots = LotBook(method)
+    for timestamp, cost in [(1, 10), (2, 30), (3, 20)]:
+        lots.acquire("XBT", 1, cost, timestamp)
+    assert lots.dispose("XBT", 1.5, 45, 4) == pytest.approx(gain)
+    assert lots.get_open_lots("XBT") == open_lots
+    assert lots.get_disposals().amount.sum() == pytest.approx(1.5)
+
+
+@pytest.mark.parametrize("method", [FIFO, LIFO, HIFO])
+def test_ledger_gains_invariant(bench, method):
+    from portfolio import Portfolio
+    get_config()["Global"]["cost_basis"] = method
+    portfolio = Portfolio.from_kraken_ledger("EUR")
+    disposals = portfolio.get_disposals()
+    assert "EUR" not in set(disposals.asset)
+
+    # Open lots hold exactly the securities
+    open_cost = 0
+    for name, security in portfolio.securities.items():
+        open_lots = portfolio.lots.get_open_lots(name)
+        if name == "EUR":
+            assert open_lots == []
+            continue
+        assert sum(amount for _, amount, _ in open_lots) == pytest.approx(security.value)
+        open_cost += sum(amount * unit_cost for _, amount, unit_cost in open_lots)
+
+    # Every lot is bought with the base currency (fees included) or with the
+    # proceeds of sold lots: gains minus open costs is the net base currency
+    # received by trades, fees deducted
+    ledger = bench.ledger
+    assert set(ledger.asset[ledger.type == "deposit"]) == {"EUR"}
+    base_legs = ledger[(ledger.type == "trade") & (ledger.asset == "EUR")]
+    received = (base_legs.amount[base_legs.amount > 0] - base_legs.fee[base_legs.amount > 0]).sum()
+    spent = (base_legs.amount[base_legs.amount < 0].abs() + base_legs.fee[base_legs.amount < 0]).sum()
+    assert disposals.gain.sum() - open_cost == pytest.approx(received - spent, rel=1e-9)
+    assert np.allclose(disposals.gain, disposals.proceeds - disposals.cost_basis)
+
+
+def test_deposit_lot_costs_its_value_at_the_deposit_date(bench):
+    from portfolio import Portfolio
+    from currencies import CurrencyUnit
+    get_config()["Global"]["cost_basis"] = FIFO
+    portfolio = Portfolio(CurrencyUnit.create_currency_unit("EUR"))
+    date = bench.market.dates[-100]
+    portfolio.top_up(2, CurrencyUnit.create_currency_unit("XXBT"), timestamp=date + pd.Timedelta(hours=12))
+    (_, amount, unit_cost), = portfolio.lots.get_open_lots("XXBT")
+    assert amount == 2
+    assert unit_cost == pytest.approx(bench.market.get_rate("XXBT", "EUR", bench.market.get_day(date)))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+from price_store import DayIndex, PriceStore, ASOF, NEAREST, to_dates
+
+DAYS = [10, 12, 20]
+WANTED = [9, 10, 11, 15, 16, 17, 25]
+
+
+@pytest.mark.parametrize("policy, max_staleness, positions", [
+    (ASOF, None, [-1, 0, 0, 1, 1, 1, 2]),
+    (ASOF, 2, [-1, 0, 0, -1, -1, -1, -1]),
+    # Ties go to the earlier close
+    (NEAREST, None, [0, 0, 0, 1, 1, 2, 2]),
+    (NEAREST, 2, [0, 0, 0, -1, -1, -1, -1]),
+    (NEAREST, 0, [-1, 0, -1, -1, -1, -1, -1]),
+])
+def test_day_index_locate(policy, max_staleness, positions):
+    located = DayIndex(DAYS).locate(to_dates(WANTED), policy=policy, max_staleness=max_staleness)
+    assert list(located) == positions
+
+
+def test_day_index_locate_without_days():
+    assert list(DayIndex([]).locate(to_dates(WANTED))) == [-1] * len(WANTED)
+
+
+def test_day_index_rejects_unknown_policies():
+    with pytest.raises(ValueError):
+        DayIndex(DAYS).locate(to_dates(WANTED), policy="latest")
+
+
+def test_price_store_lookups(tmp_path):
+    store = PriceStore(str(tmp_path))
+    store.append("XXBT", "EUR", pd.Series([1.0, 2.0, 3.0], index=to_dates(DAYS)))
+    # Out of order closes are merged
+    store.append("XXBT", "EUR", pd.Series([1.5], index=to_dates([11])))
+    assert list(store.read("XXBT", "EUR").values) == [1.0, 1.5, 2.0, 3.0]
+    closes = store.lookup_many("XXBT", "EUR", to_dates(WANTED), policy=NEAREST, max_staleness=2)
+    assert np.array_equal(closes, [1.0, 1.0, 1.5, np.nan, np.nan, np.nan, np.nan], equal_nan=True)
+    assert store.lookup("XXBT", "EUR", to_dates([12])[0]) == 2.0
+    assert store.lookup("XXBT", "EUR", to_dates([13])[0]) is None
+    assert store.covers("XXBT", "EUR", to_dates([10, 11, 12]))
+    assert not store.covers("XXBT", "EUR", to_dates([10, 13]))
+    store.mark_missing("XXBT", "EUR", to_dates([13]))
+    assert store.covers("XXBT", "EUR", to_dates([10, 13]))
+
+
+def test_latest_prices_of_a_batch_are_written_once(bench, monkeypatch):
+    import price_store
+    from currencies import fetch_latest_prices, PRICE_STORE
+    from portfolio import Portfolio
+    portfolio = Portfolio.from_kraken_ledger("EUR")
+    writes = []
+    atomic_write = price_store.atomic_write
+
+    def spy(path, blob):
+        writes.append(path)
+        return atomic_write(path, blob)
+    monkeypatch.setattr(price_store, "atomic_write", spy)
+    fetch_latest_prices(list(portfolio.securities), "EUR", refresh=True)
+    assert writes == [PRICE_STORE.latest_path]
+    for name in portfolio.securities:
+        if name != "EUR":
+            price, _ = PRICE_STORE.get_latest(name, "EUR")
+            assert price == pytest.approx(bench.market.get_rate(name, "EUR"))
@@ -0,0 +1,34 @@
+import os
+import time
+import pytest
+from benchmark import FakeKrakenClient, MarketModel, BENCHMARK_CRYPTOS
+from routes import load_asset_pairs
+from utils import get_asset_pairs, encode_blob, atomic_write, ASSET_PAIRS_FILE
+
+
+class OfflineClient(FakeKrakenClient):
+    def get_tradable_asset_pairs(self):
+        raise ConnectionError("Kraken is unreachable")
+
+
+@pytest.fixture(autouse=True)
+def data_dir(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+
+
+def test_asset_pairs_fall_back_to_the_stale_ones_offline():
+    market = MarketModel(BENCHMARK_CRYPTOS[:4], days=10)
+    asset_pairs = get_asset_pairs(FakeKrakenClient(market))
+    # Fetched three days ago, past the one day expiration
+    atomic_write(os.path.join("data", ASSET_PAIRS_FILE),
+                 encode_blob({"value": asset_pairs, "ts": time.time() - 3 * 86400}))
+    offline = OfflineClient(market)
+    with pytest.raises(ConnectionError):
+        get_asset_pairs(offline)
+    assert load_asset_pairs(offline).equals(asset_pairs)
+
+
+def test_asset_pairs_never_fetched_offline():
+    with pytest.raises(ConnectionError):
+        load_asset_pairs(OfflineClient(MarketModel(BENCHMARK_CRYPTOS[:4], days=10)))
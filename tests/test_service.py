@@ -0,0 +1,83 @@
+import json
+import pytest
+from history import TOTAL_COLUMN
+
+
+@pytest.fixture
+def service(bench):
+    from service import PortfolioService
+    return PortfolioService("EUR")
+
+
+def get(service, url):
+    status, body = service.respond(url)
+    return status, json.loads(body)
+
+
+def last_ids(ledger):
+    # Legs of a trade share their timestamp and may be stored in any order
+    return set(ledger.ledger_id[ledger.index == ledger.index[-1]])
+
+
+def expected_value(service, market, currency):
+    return sum(security.value * market.get_rate(name, currency)
+               for name, security in service.portfolio.securities.items())
+
+
+def test_queries(bench, service):
+    status, health = get(service, "/health")
+    assert status == 200
+    assert health["last_ledger_id"] in last_ids(bench.ledger)
+
+    status, value = get(service, "/value")
+    assert status == 200
+    total = service.portfolio.get_metrics().loc[TOTAL_COLUMN]
+    assert value["value"] == pytest.approx(total["current_value"])
+    assert value["value"] == pytest.approx(expected_value(service, bench.market, "EUR"))
+    status, usd = get(service, "/value?currency=USD")
+    assert usd["value"] == pytest.approx(value["value"] * bench.market.get_rate("EUR", "USD"))
+
+    status, returns = get(service, "/returns")
+    assert returns["current_value"] == pytest.approx(value["value"])
+    status, metrics = get(service, "/metrics?currency=USD")
+    assert set(metrics) == set(service.portfolio.securities) | {TOTAL_COLUMN}
+    status, history = get(service, "/history?func=get_current_value&start=2000-01-01")
+    assert status == 200
+    assert len(history["data"]) == len(history["index"]) > 0
+
+    # Bodies are kept until the next refresh
+    assert service.respond("/value?currency=USD")[1] is service.respond("/value?currency=USD")[1]
+    assert service.respond("/unknown")[0] == 404
+    assert service.respond("/history?func=display")[0] == 400
+
+
+def test_refresh_prices_updates_the_queried_currencies(bench, service):
+    get(service, "/value?currency=USD")
+    # EUR gains 10% against every other asset
+    bench.market.prices["EUR"][-1] *= 1.1
+    service.refresh_prices()
+    status, usd = get(service, "/value?currency=USD")
+    assert usd["value"] == pytest.approx(expected_value(service, bench.market, "USD"))
+    status, eur = get(service, "/value")
+    assert eur["value"] == pytest.approx(expected_value(service, bench.market, "EUR"))
+
+
+def test_sync_ledger_replays_new_entries(bench):
+    from service import PortfolioService
+    ledger = bench.ledger
+    # Cut the ledger between two transactions
+    cut = next(i for i in range(len(ledger) // 2, len(ledger))
+               if ledger.refid.iloc[i] != ledger.refid.iloc[i - 1])
+    bench.client.ledger = ledger.iloc[:cut]
+    service = PortfolioService("EUR")
+    assert service.portfolio.last_ledger_id in last_ids(ledger.iloc[:cut])
+    get(service, "/value")
+
+    bench.client.ledger = ledger
+    service.sync_ledger()
+    assert service.responses == {}
+    assert service.portfolio.last_ledger_id in last_ids(ledger)
+    deposits = ledger.amount[ledger.type == "deposit"].sum()
+    assert service.portfolio._total_invested == pytest.approx(deposits)
+    status, value = get(service, "/value")
+    assert value["value"] == pytest.approx(expected_value(service, bench.market, "EUR"))
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+from snapshots import SnapshotStore, SNAPSHOT_FIELDS, PORTFOLIO_KEY
+
+
+def test_states_at_matches_state_at(bench):
+    from portfolio import Portfolio
+    portfolio = Portfolio.from_kraken_ledger("EUR")
+    snapshots = portfolio.snapshots
+    dates = pd.date_range(bench.ledger.index[0].normalize() - pd.Timedelta(days=2),
+                          bench.ledger.index[-1].normalize())
+    keys, states = snapshots.states_at(dates)
+    for row, date in zip(states, dates):
+        state = snapshots.state_at(date)
+        for i, key in enumerate(keys):
+            if key in state:
+                assert np.allclose(row[i], state[key])
+            else:
+                assert np.isnan(row[i]).all()
+
+    # The last state is the one of the replayed portfolio
+    last = states[-1]
+    for name, security in portfolio.securities.items():
+        assert np.allclose(last[keys.index(name)],
+                           [getattr(security, field) for field in SNAPSHOT_FIELDS])
+    assert np.allclose(last[keys.index(PORTFOLIO_KEY), 1:],
+                       [portfolio._total_invested, portfolio.total_invested_up_now,
+                        portfolio.realized_profit])
+
+
+def test_snapshots_are_chronological():
+    snapshots = SnapshotStore(capacity=1)
+    snapshots.append(2, "XXBT", [1, 1, 1, 0])
+    # Unchanged states are not recorded
+    snapshots.append(3, "XXBT", [1, 1, 1, 0])
+    snapshots.append(3, "XETH", [2, 2, 2, 0])
+    assert len(snapshots) == 2
+    with pytest.raises(ValueError):
+        snapshots.append(1, "XXBT", [0, 0, 0, 0])
+    assert snapshots.count_until(pd.Timestamp(3)) == 2
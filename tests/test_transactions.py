@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import synthetic_ledger
+from transactions import parse_ledger, iter_transactions, DEPOSIT, TRADE
+
+
+@pytest.fixture(scope="module")
+def ledger():
+    return synthetic_ledger(200)
+
+
+def chunked(ledger, chunk_size):
+    return [ledger.iloc[i:i + chunk_size] for i in range(0, len(ledger), chunk_size)]
+
+
+def trade_rows(ledger):
+    return np.flatnonzero((ledger.type == "trade").values)
+
+
+def drop_row(ledger, position):
+    # Both legs of a trade share their timestamp, rows are dropped by position
+    return ledger.iloc[np.arange(len(ledger)) != position]
+
+
+def named(transactions):
+    """Records with the asset names, asset ids are only valid within a batch"""
+    assets = np.array(transactions.assets + [None], dtype=object)
+    return [(record["timestamp"], record["kind"], assets[record["sell_asset"]], record["sell_amount"],
+             assets[record["buy_asset"]], record["buy_amount"]) for record in transactions.records]
+
+
+def test_parse_ledger_pairs_trade_legs(ledger):
+    transactions = parse_ledger(ledger)
+    trades = ledger[ledger.type == "trade"]
+    assert len(transactions) == (ledger.type == "deposit").sum() + trades.refid.nunique()
+    assert (np.diff(transactions.records["timestamp"]) >= 0).all()
+    # Each transaction ends on its last ledger entry, in ledger order
+    positions = pd.Index(ledger.ledger_id).get_indexer(transactions.ledger_ids)
+    assert (np.diff(positions) > 0).all()
+    assert transactions.last_ledger_id == ledger.ledger_id.iloc[-1]
+    first_trade = transactions.records[transactions.records["kind"] == TRADE][0]
+    sold, bought = trades.iloc[0], trades.iloc[1]
+    assert transactions.assets[first_trade["sell_asset"]] == sold.asset
+    assert first_trade["sell_amount"] == -sold.amount
+    assert transactions.assets[first_trade["buy_asset"]] == bought.asset
+    assert first_trade["buy_amount"] == bought.amount
+    assert transactions.records[0]["kind"] == DEPOSIT
+
+
+def test_parse_ledger_drops_other_types(ledger):
+    staking = ledger.iloc[[-1]].assign(type="staking", refid="S1", ledger_id="LSTAKE")
+    transactions = parse_ledger(pd.concat([ledger, staking]))
+    assert len(transactions) == len(parse_ledger(ledger))
+    assert transactions.last_ledger_id == "LSTAKE"
+
+
+@pytest.mark.parametrize("corrupt", ["missing_leg", "third_leg", "two_sold"])
+def test_parse_ledger_rejects_corrupted_trades(ledger, corrupt):
+    trade = trade_rows(ledger)[0]
+    if corrupt == "missing_leg":
+        ledger = drop_row(ledger, trade + 1)
+    elif corrupt == "third_leg":
+        ledger = pd.concat([ledger, ledger.iloc[[trade + 1]]])
+    else:
+        ledger = ledger.copy()
+        ledger.iloc[trade + 1, ledger.columns.get_loc("amount")] *= -1
+    with pytest.raises(ValueError, match="Corrupted ledger"):
+        parse_ledger(ledger)
+
+
+def test_iter_transactions_pairs_legs_across_chunks(ledger):
+    # The legs of a trade sit at both sides of a chunk boundary
+    chunk_size = trade_rows(ledger)[0] + 1
+    batches = list(iter_transactions(chunked(ledger, chunk_size), chunk_size=chunk_size))
+    assert sum([named(batch) for batch in batches], []) == named(parse_ledger(ledger))
+    assert batches[-1].last_ledger_id == ledger.ledger_id.iloc[-1]
+
+
+def test_iter_transactions_rejects_an_orphan_leg(ledger):
+    orphan = drop_row(ledger, trade_rows(ledger)[0] + 1)
+    with pytest.raises(ValueError, match="Corrupted ledger"):
+        list(iter_transactions(chunked(orphan, 30), chunk_size=30))
+
+
+def test_iter_transactions_waits_for_the_last_leg(ledger):
+    # The second leg of the last trade is not in the ledger yet
+    last_trade = trade_rows(ledger)[-1]
+    partial = ledger.iloc[:last_trade]
+    batches = list(iter_transactions(chunked(partial, 30), chunk_size=30))
+    assert batches[-1].last_ledger_id == ledger.ledger_id.iloc[last_trade - 2]
+    assert sum(len(batch) for batch in batches) == len(parse_ledger(ledger.iloc[:last_trade - 1]))
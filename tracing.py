@@ -0,0 +1,47 @@
+import json
+import time
+import random
+
+
+class Tracer():
+    """Structured JSON tracing of state transitions, a no-op unless enabled.
+
+    Call sites check `TRACER.enabled` before building an event, so a disabled
+    tracer costs a single attribute lookup. When enabled, each event is kept
+    with probability `sample_rate` and written as one JSON line.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.stream = None
+
+    def configure(self, enabled=False, sample_rate=1.0, path="trace.jsonl"):
+        self.close()
+        self.sample_rate = sample_rate
+        if enabled:
+            self.stream = open(path, "a")
+        self.enabled = enabled
+
+    def configure_from(self, config):
+        if not config.has_section("Trace"):
+            return
+        self.configure(enabled=config["Trace"].getboolean("enabled", False),
+                       sample_rate=float(config["Trace"].get("sample_rate", 1.0)),
+                       path=config["Trace"].get("path", "trace.jsonl"))
+
+    def emit(self, event, **fields):
+        if (not self.enabled) or (random.random() >= self.sample_rate):
+            return
+        fields["event"] = event
+        fields["ts"] = time.time()
+        self.stream.write(json.dumps(fields, default=str) + "\n")
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = None
+        self.enabled = False
+
+
+TRACER = Tracer()
@@ -0,0 +1,137 @@
+import logging
+import numpy as np
+import pandas as pd
+
+DEPOSIT, WITHDRAWAL, TRADE = 0, 1, 2
+LEDGER_KINDS = {"deposit": DEPOSIT, "withdrawal": WITHDRAWAL, "trade": TRADE}
+
+# Deposits fill the buy_* fields, withdrawals the sell_* fields.
+# Asset fields index Transactions.assets (-1 when unused).
+TRANSACTION_DTYPE = np.dtype([
+    ("timestamp", "<i8"),
+    ("kind", "i1"),
+    ("sell_asset", "<i4"),
+    ("sell_amount", "<f8"),
+    ("sell_fee", "<f8"),
+    ("buy_asset", "<i4"),
+    ("buy_amount", "<f8"),
+    ("buy_fee", "<f8"),
+])
+
+
+class Transactions():
+    def __init__(self, records, assets, ledger_ids, last_ledger_id=None):
+        self.records = records
+        self.assets = assets
+        # Id of the last ledger entry of each transaction
+        self.ledger_ids = ledger_ids
+        # Id of the last parsed ledger entry, including the dropped ones
+        self.last_ledger_id = last_ledger_id
+
+    def __len__(self):
+        return len(self.records)
+
+
+def parse_ledger(ledger):
+    """Turn Kraken ledger entries into a chronological array of transactions.
+
+    Trade legs are paired by `refid`: every trade must have exactly one leg
+    with a negative amount (sold) and one with a positive amount (bought),
+    otherwise the ledger is considered corrupted. Ledger types other than
+    deposit, withdrawal and trade are dropped.
+    """
+    if ledger.empty:
+        return Transactions(np.empty(0, dtype=TRANSACTION_DTYPE), [], np.empty(0, dtype=object))
+
+    kinds = ledger.type.map(LEDGER_KINDS).fillna(-1).values.astype(np.int8)
+    assets, asset_ids = np.unique(
+        ledger.asset.values.astype(str), return_inverse=True)
+    amounts = ledger.amount.values.astype(np.float64)
+    fees = ledger.fee.values.astype(np.float64)
+    timestamps = pd.DatetimeIndex(ledger.index).values.astype(
+        "datetime64[ns]").astype(np.int64)
+    positions = np.arange(len(ledger))
+
+    # Deposits and withdrawals map to a single ledger entry
+    single = positions[(kinds == DEPOSIT) | (kinds == WITHDRAWAL)]
+    single_records = np.zeros(len(single), dtype=TRANSACTION_DTYPE)
+    single_records["timestamp"] = timestamps[single]
+    single_records["kind"] = kinds[single]
+    is_deposit = kinds[single] == DEPOSIT
+    single_records["buy_asset"] = np.where(is_deposit, asset_ids[single], -1)
+    single_records["buy_amount"] = np.where(
+        is_deposit, np.abs(amounts[single]), 0)
+    single_records["buy_fee"] = np.where(is_deposit, np.abs(fees[single]), 0)
+    single_records["sell_asset"] = np.where(
+        is_deposit, -1, asset_ids[single])
+    single_records["sell_amount"] = np.where(
+        is_deposit, 0, np.abs(amounts[single]))
+    single_records["sell_fee"] = np.where(is_deposit, 0, np.abs(fees[single]))
+
+    # Trades are made of two legs sharing the same refid
+    legs = positions[kinds == TRADE]
+    group_ids, _ = pd.factorize(ledger.refid.values[legs])
+    n_trades = group_ids.max() + 1 if len(legs) else 0
+    is_sold = amounts[legs] < 0
+    if len(legs) and ((np.bincount(group_ids, minlength=n_trades) != 2).any() or
+                      (np.bincount(group_ids, weights=is_sold, minlength=n_trades) != 1).any()):
+        raise ValueError("Corrupted ledger")
+    sell_legs = np.empty(n_trades, dtype=np.int64)
+    buy_legs = np.empty(n_trades, dtype=np.int64)
+    sell_legs[group_ids[is_sold]] = legs[is_sold]
+    buy_legs[group_ids[~is_sold]] = legs[~is_sold]
+    last_legs = np.maximum(sell_legs, buy_legs)
+
+    trade_records = np.zeros(n_trades, dtype=TRANSACTION_DTYPE)
+    trade_records["timestamp"] = timestamps[last_legs]
+    trade_records["kind"] = TRADE
+    trade_records["sell_asset"] = asset_ids[sell_legs]
+    trade_records["sell_amount"] = np.abs(amounts[sell_legs])
+    trade_records["sell_fee"] = fees[sell_legs]
+    trade_records["buy_asset"] = asset_ids[buy_legs]
+    trade_records["buy_amount"] = amounts[buy_legs]
+    trade_records["buy_fee"] = fees[buy_legs]
+
+    # Transactions are ordered by the position of their last ledger entry
+    records = np.concatenate([single_records, trade_records])
+    last_positions = np.concatenate([single, last_legs])
+    order = np.argsort(last_positions, kind="stable")
+    ledger_ids = ledger.ledger_id.values[last_positions[order]]
+    return Transactions(records[order], list(assets), ledger_ids,
+                        last_ledger_id=ledger.ledger_id.values[-1])
+
+
+def iter_transactions(chunks, chunk_size=None):
+    """Parse ledger chunks one at a time, see parse_ledger.
+
+    A trade whose legs are split over two chunks cannot be paired yet: the
+    entries from its first leg on are carried over to the next chunk, so
+    every yielded batch ends on a complete prefix of the ledger. A carried
+    leg the next chunk does not complete, or more than `chunk_size` carried
+    entries, make the ledger corrupted as in parse_ledger. Only entries
+    carried past the last chunk (a trade whose second leg is not in the
+    ledger yet) are left out and picked up by the next replay.
+    """
+    carried = None
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        next_chunk = next(chunks, None)
+        n_carried = 0 if carried is None else len(carried)
+        if n_carried:
+            chunk = pd.concat([carried, chunk])
+        trades = (chunk.type == "trade").values
+        unpaired = np.zeros(len(chunk), dtype=bool)
+        unpaired[trades] = ~chunk.refid[trades].duplicated(keep=False).values
+        if unpaired[:n_carried].any() and (next_chunk is not None):
+            raise ValueError("Corrupted ledger")
+        end = np.argmax(unpaired) if unpaired.any() else len(chunk)
+        carried = chunk.iloc[end:]
+        if (chunk_size is not None) and (len(carried) > chunk_size):
+            raise ValueError("Corrupted ledger")
+        if end:
+            yield parse_ledger(chunk.iloc[:end])
+        chunk = next_chunk
+    if (carried is not None) and len(carried):
+        logging.warning(
+            f"{len(carried)} ledger entries wait for the other leg of trade {carried.refid.iloc[0]}")
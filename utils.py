@@ -2,26 +2,138 @@ import json
 import time
 import os
 import pickle
-import requests
+import struct
+import hashlib
 import logging
+import tempfile
+import threading
+from contextlib import contextmanager
 import pandas as pd
 import numbers
-from pykrakenapi.pykrakenapi import KrakenAPIError
 import datetime
+from functools import lru_cache
+from profiling import PROFILER, profiled
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, writes are still atomic
+    fcntl = None
+
+# Cached blobs: magic, format version, sha256 of the pickled payload, payload
+CACHE_MAGIC = b"KPFC"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct(">4sH32s")
+
+# [thread lock, depth, lock file] of the file locks held by this process
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
 
 def url_join(*urls):
     return '/'.join(url.strip('/') for url in urls)
 
 
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on `path` shared by all the processes writing it.
+
+    The lock is taken on a `.lock` file next to `path`, so that the target
+    itself can be replaced while the lock is held. It is reentrant within a
+    thread and excludes the other threads of the process as well.
+    """
+    path = os.path.abspath(path)
+    with _file_locks_lock:
+        lock = _file_locks.setdefault(path, [threading.RLock(), 0, None])
+    with lock[0]:
+        if lock[1] == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock[2] = open(path + ".lock", "a")
+            if fcntl is not None:
+                fcntl.flock(lock[2], fcntl.LOCK_EX)
+        lock[1] += 1
+        try:
+            yield
+        finally:
+            lock[1] -= 1
+            if lock[1] == 0:
+                if fcntl is not None:
+                    fcntl.flock(lock[2], fcntl.LOCK_UN)
+                lock[2].close()
+                lock[2] = None
+
+
+def atomic_write(path, data, mode="wb"):
+    """Write `data` to a temporary file renamed over `path` once complete.
+
+    Readers see either the previous or the new content, never a partial
+    write, even if the process dies halfway.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def encode_blob(obj):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION,
+                             hashlib.sha256(payload).digest()) + payload
+
+
+def blob_payload(blob):
+    """Pickled payload of a cached blob, raising ValueError when it can not be trusted"""
+    if not blob.startswith(CACHE_MAGIC):
+        # Legacy cache written before the header was introduced
+        return blob
+    if len(blob) < CACHE_HEADER.size:
+        raise ValueError("truncated header")
+    _, version, checksum = CACHE_HEADER.unpack_from(blob)
+    if version != CACHE_VERSION:
+        raise ValueError(f"cache format version {version} != {CACHE_VERSION}")
+    payload = memoryview(blob)[CACHE_HEADER.size:]
+    if hashlib.sha256(payload).digest() != checksum:
+        raise ValueError("checksum mismatch")
+    return payload
+
+
+def verify_data(path, add_path_prefix=False):
+    """Whether the blob at `path` can be read, without unpickling it"""
+    if add_path_prefix:
+        path = os.path.join("./data", path)
+    if not os.path.exists(path):
+        return False
+    with open(path, "rb") as f:
+        blob = f.read()
+    try:
+        blob_payload(blob)
+    except ValueError:
+        return False
+    return True
+
+
+@profiled("read_data")
 def read_data(path, add_path_prefix=False):
+    """Cached blob at `path`, None if missing or corrupt (it is then rebuilt)"""
     if add_path_prefix:
         path = os.path.join("./data", path)
     if not os.path.exists(path):
         return None
-    return_val = None
     with open(path, "rb") as f:
-        return_val = pickle.load(f)
-    return return_val
+        blob = f.read()
+    try:
+        return pickle.loads(blob_payload(blob))
+    except Exception as e:
+        logging.warning(f"Ignoring corrupt cache {path}: {e}")
+        return None
 
 
 def read_json(path):
@@ -31,19 +143,30 @@ def read_json(path):
     return return_val
 
 
+@profiled("save_data")
 def save_data(obj, path, add_path_prefix=True):
     obj = {"value": obj}
     if add_path_prefix:
         path = os.path.join("./data", path)
     obj["ts"] = time.time()
-    with open(path, "wb") as f:
-        pickle.dump(obj, f)
+    blob = encode_blob(obj)
+    with file_lock(path):
+        atomic_write(path, blob)
+
+
+def get_account_path(account, file_name):
+    """Path relative to ./data of a file kept per account, the shared one if `account` is None"""
+    if account is None:
+        return file_name
+    return os.path.join("accounts", account, file_name)
 
 
 def get_cached(file_name, expiration=3600):
     path = os.path.join("./data", file_name)
     if os.path.exists(path):
         json_dump = read_data(path)
+        if json_dump is None:
+            return None
         ts = json_dump["ts"]
         if (time.time() - ts) > expiration:
             return None
@@ -93,79 +216,51 @@ def ts_format(ts=None):
 KRAKEN_PUBLIC_END_POINT = "https://api.kraken.com/0/public/"
 URL_MARKET_PRICE = url_join(KRAKEN_PUBLIC_END_POINT, "Ticker")
 URL_MARKET_PRICE_FIAT = "https://api.ratesapi.io/api"
-FIAT_CURRENCIES = read_json("./data/Common-Currency.json")
-CRYPTO_ALT_NAMES = read_json("./data/crypto_ticker_converter.json")
-
+PROXY_CURRENCIES = ["USD", "EUR", "GBP"]
+ASSET_PAIRS_FILE = "asset_pairs.pkl"
 
-def get_pair_from_kraken(from_curr, to_curr, client, date=None):
-    new_name = CRYPTO_ALT_NAMES.get(from_curr, from_curr)
-    logging.debug(f"Get pair {from_curr}/{to_curr} from Kraken")
 
-    if (date is None) or (date == "latest"):
-        return retry_kraken(get_latest_pair_from_kraken(client), new_name, to_curr, index_normalize=False)
-    else:
-        res = retry_kraken(get_ohlc_from_kraken(client),
-                           new_name, to_curr)
-        return res
+@lru_cache(maxsize=None)
+def get_fiat_currencies():
+    return read_json("./data/Common-Currency.json")
 
 
-def get_latest_pair_from_kraken(client):
-    def inner_func(pair):
-        price = float(client.get_ticker_information(pair)["c"].iloc[0][0])
-        return price
-    return inner_func
+@lru_cache(maxsize=None)
+def get_crypto_alt_names():
+    return read_json("./data/crypto_ticker_converter.json")
 
 
-def get_ohlc_from_kraken(client):
-    def inner_func(pair):
-        price = client.get_ohlc_data(pair, interval=1440)[0]
-        return price
-    return inner_func
+def get_asset_pairs(client, expiration=86400):
+    cached = get_cached(ASSET_PAIRS_FILE, expiration=expiration)
+    if cached is not None:
+        return cached["value"]
+    with PROFILER.timer("network.kraken.asset_pairs"):
+        asset_pairs = client.get_tradable_asset_pairs()
+    save_data(asset_pairs, ASSET_PAIRS_FILE)
+    return asset_pairs
 
 
-def retry_kraken(func, from_currency, to_currency, index_normalize=True, *args, **kwargs):
-    """If a direct conversion is not available convert to proxy_currencies_first first"""
-    pair = f"{from_currency}{to_currency}"
+def get_pair_names(asset_pairs):
+    """Map the name and altname of every Kraken pair to its name"""
+    pair_names = {name: name for name in asset_pairs.index}
+    pair_names.update(zip(asset_pairs.altname, asset_pairs.index))
+    return pair_names
 
-    try:
-        price_data = func(pair=pair, *args, **kwargs)
-
-    except KrakenAPIError:
-        logging.debug(
-            f"Failed to convert {from_currency} to {to_currency}: Trying to go through a proxy currency")
-
-        price_data_1,price_data_2= retry_conversion(func, from_currency, to_currency, *args, **kwargs)
-
-        if index_normalize:
-            price_data_1.index = price_data_1.index.normalize()
-            price_data_2.index = price_data_2.index.normalize()
-            if len(price_data_1) < len(price_data_2):
-                price_data_2 = price_data_2.loc[price_data_1.index]
-            else:
-                price_data_1 = price_data_1.loc[price_data_2.index]
-        price_data = price_data_1*price_data_2
-
-    return price_data
-
-
-def retry_conversion(func,from_currency, to_currency, *args, **kwargs):
-    proxy_currencies = ["USD", "EUR", "GBP"]
-    pair_1,pair_2 = None,None
-    for currency in proxy_currencies:
-        pair_1 = f"{from_currency}{currency}"
-        pair_2 = f"{currency}{to_currency}"
-        try:
-            price_data_1 = func(pair=pair_1, *args, **kwargs)
 
-            logging.debug(f"{pair_1} conversion Successfull")
-            price_data_2 = func(pair=pair_2, *args, **kwargs)
-            logging.debug(f"{pair_2} conversion Successfull")
-        except:
-            continue
-        return price_data_1, price_data_2
+def get_latest_pairs_from_kraken(client, pairs):
+    """Latest price of many pairs with a single Ticker request.
 
-    raise ValueError(
-            f"Cannot convert {from_currency} to {to_currency}")
+    Returns {pair: price} for the requested pairs known to Kraken.
+    """
+    pair_names = get_pair_names(get_asset_pairs(client))
+    requested = {pair: pair_names[pair] for pair in pairs if pair in pair_names}
+    if not requested:
+        return {}
+    with PROFILER.timer("network.kraken.ticker"):
+        ticker = client.get_ticker_information(
+            ",".join(sorted(set(requested.values()))))
+    return {pair: float(ticker.loc[name, "c"][0]) for pair, name in requested.items()
+            if name in ticker.index}
 
 
 def str2date(str_date):